@@ -0,0 +1,64 @@
+import sqlite3
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+
+from dataset_cache import grouped_amounts
+
+
+class DataLoader(QObject):
+    """Runs the pie queries and grouping on a worker thread with its own connection.
+
+    Each widget asks for data with request(), which returns a generation
+    number. Asking again supersedes the earlier request: one still waiting in
+    the queue is skipped, and a result that finishes late is never emitted,
+    so only the newest toggle reaches the UI. Results arrive on the GUI
+    thread through the loaded and failed signals.
+    """
+
+    loaded = pyqtSignal(str, int, object)  # widget key, generation, grouped Series
+    failed = pyqtSignal(str, int, str)
+    _requested = pyqtSignal(str, int, str, bool, str)
+
+    def __init__(self, db_file):
+        super().__init__()
+        self.db_file = db_file
+        self._conn = None
+        self._generation = 0
+        self._latest = {}
+        self._thread = QThread()
+        self.moveToThread(self._thread)
+        # the loader lives on the worker thread, so this connection is queued
+        self._requested.connect(self._load)
+        self._thread.start()
+
+    def request(self, key, amount_col, use_full_category=True, essential_filter='ALL'):
+        self._generation += 1
+        self._latest[key] = self._generation
+        self._requested.emit(key, self._generation, amount_col, use_full_category, essential_filter)
+        return self._generation
+
+    def is_current(self, key, generation):
+        return self._latest.get(key) == generation
+
+    @pyqtSlot(str, int, str, bool, str)
+    def _load(self, key, generation, amount_col, use_full_category, essential_filter):
+        if not self.is_current(key, generation):
+            return
+        if self._conn is None:
+            # only ever used from the worker thread; closed by stop() once it has finished
+            self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        try:
+            grouped = grouped_amounts(self._conn, amount_col, use_full_category, essential_filter)
+        except sqlite3.Error as e:
+            self.failed.emit(key, generation, str(e))
+            return
+        if self.is_current(key, generation):
+            self.loaded.emit(key, generation, grouped)
+
+    def stop(self):
+        self._latest.clear()
+        self._thread.quit()
+        self._thread.wait()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
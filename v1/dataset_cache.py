@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+
+# the one dataset both pies and both GUIs group, and the DB version it came from
+_cache = {'key': None, 'df': None}
+
+
+def db_file_of(conn):
+    row = conn.execute('PRAGMA database_list').fetchone()
+    return row[2] if row and row[2] else None
+
+
+def db_version(conn):
+    """Something that changes whenever the database does.
+
+    data_version moves when another connection commits; the file's size and
+    modification time catch the database being rebuilt by load_statement.py.
+    """
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    path = db_file_of(conn)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        st = None
+    return (path, data_version, st and st.st_mtime_ns, st and st.st_size)
+
+
+def load_dataset(conn):
+    """All transactions with their category, split once into its top level.
+
+    Cached per database version, so toggling the GUI only regroups this
+    frame. Columns: id, date, transaction_type, description, paid_out,
+    paid_in, category, top_category, essential.
+    """
+    key = (id(conn), db_version(conn))
+    if _cache['key'] == key:
+        return _cache['df']
+
+    rows = conn.execute('''
+        SELECT t.id, t.date, t.transaction_type, t.description,
+               COALESCE(t.paid_out, 0), COALESCE(t.paid_in, 0),
+               COALESCE(cg.category, 'Uncategorised'), COALESCE(cg.essential, 'N')
+        FROM transactions t
+        LEFT JOIN categorised cg ON t.id = cg.transaction_id
+    ''').fetchall()
+    df = pd.DataFrame(rows, columns=['id', 'date', 'transaction_type', 'description',
+                                     'paid_out', 'paid_in', 'category', 'essential'])
+    # split each distinct category once rather than once per row
+    categories = df['category'].astype('category')
+    tops = categories.cat.categories.str.split(';').str[0].str.strip()
+    df['top_category'] = pd.Categorical(tops[categories.cat.codes])
+    df['category'] = categories
+    df['essential'] = df['essential'].astype('category')
+
+    _cache['key'] = key
+    _cache['df'] = df
+    return df
+
+
+def grouped_amounts(conn, amount_col, use_full_category=True, essential_filter='ALL'):
+    """Total amount_col per category (or top-level category), largest first."""
+    df = load_dataset(conn)
+    mask = df[amount_col] > 0
+    if essential_filter in ('Y', 'N'):
+        mask &= df['essential'] == essential_filter
+    column = 'category' if use_full_category else 'top_category'
+    grouped = df.loc[mask].groupby(column, observed=True)[amount_col].sum()
+    return grouped.sort_values(ascending=False)
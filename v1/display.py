@@ -9,6 +9,9 @@ from PyQt6.QtCore import Qt, QAbstractTableModel
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from data_loader import DataLoader
+from txn_model import SqlTransactionModel, ensure_indexes
+
 DB_FILE = 'load_statement.db'
 
 class PandasModel(QAbstractTableModel):
@@ -50,16 +53,22 @@ class PandasModel(QAbstractTableModel):
 
 
 class PieChartWithTable(QWidget):
-    def __init__(self, db_conn, is_paid_out=True, use_full_category=True):
+    def __init__(self, db_conn, loader, is_paid_out=True, use_full_category=True):
         super().__init__()
         self.db_conn = db_conn
+        self.loader = loader
         self.is_paid_out = is_paid_out
         self.use_full_category = use_full_category
         self.essential_filter = 'ALL'  # 'ALL', 'Y', 'N'
+        self.key = 'paid_out' if is_paid_out else 'paid_in'
 
-        self.df = pd.DataFrame()
         self.current_selected_category = None
+        self.grouped = None
+        self.categories = []
+        self.wedges = []
         self.init_ui()
+        self.loader.loaded.connect(self.on_data_loaded)
+        self.loader.failed.connect(self.on_data_failed)
         self.refresh()
 
     def init_ui(self):
@@ -96,42 +105,44 @@ class PieChartWithTable(QWidget):
     def refresh(self):
         self.current_selected_category = None
         self.category_label.setText("Click a segment to see transactions")
+        self.table.setModel(None)
         self.load_data()
+
+    def load_data(self):
+        # queried and grouped on the loader's thread (the query and category
+        # split are cached there per database version); the pie shows a
+        # loading state until the newest request's result comes back
+        self.amount_col = 'paid_out' if self.is_paid_out else 'paid_in'
+        self.loader.request(self.key, self.amount_col, self.use_full_category, self.essential_filter)
+        self.grouped = None
+        self.category_table.setModel(None)
+        self.show_message("Loading…")
+
+    def on_data_loaded(self, key, generation, grouped):
+        # results of superseded toggles are dropped
+        if key != self.key or not self.loader.is_current(key, generation):
+            return
+        self.grouped = grouped
         self.draw_pie()
         self.populate_category_table()
-        self.table.setModel(None)
 
-    def load_data(self):
-        cursor = self.db_conn.cursor()
-        amount_col = 'paid_out' if self.is_paid_out else 'paid_in'
-        query = f'''
-            SELECT t.id, t.date, t.transaction_type, t.description, t.{amount_col}, cg.category, cg.essential
-            FROM transactions t
-            LEFT JOIN categorised cg ON t.id = cg.transaction_id
-            WHERE t.{amount_col} > 0
-        '''
-        # apply essential filter (treat NULL as 'N')
-        if self.essential_filter == 'Y':
-            query = query.strip() + f" AND COALESCE(cg.essential,'N') = 'Y'"
-        elif self.essential_filter == 'N':
-            query = query.strip() + f" AND COALESCE(cg.essential,'N') = 'N'"
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        columns = ['id', 'date', 'transaction_type', 'description', amount_col, 'category', 'essential']
-        df = pd.DataFrame(rows, columns=columns)
-        df['category'] = df['category'].fillna('Uncategorised')
-        df['essential'] = df['essential'].fillna('N')
-        if not self.use_full_category:
-            df['category'] = df['category'].apply(lambda c: c.split(';')[0].strip())
-        self.df = df
-        self.amount_col = amount_col
-        self.grouped = self.df.groupby('category')[amount_col].sum().sort_values(ascending=False)
+    def on_data_failed(self, key, generation, message):
+        if key != self.key or not self.loader.is_current(key, generation):
+            return
+        print(f"⚠️ Could not load transactions: {message}")
+        self.show_message("Could not load transactions")
+
+    def show_message(self, text):
+        self.wedges = []
+        self.categories = []
+        self.ax.clear()
+        self.ax.text(0.5, 0.5, text, ha='center', va='center')
+        self.canvas.draw_idle()
 
     def draw_pie(self):
         self.ax.clear()
         if self.grouped.empty:
-            self.ax.text(0.5, 0.5, "No data", ha='center', va='center')
-            self.canvas.draw()
+            self.show_message("No data")
             return
         wedges, _, _ = self.ax.pie(
             self.grouped.values,
@@ -172,12 +183,12 @@ class PieChartWithTable(QWidget):
             return
         self.current_selected_category = category
         self.category_label.setText(f"Transactions in category: {category}")
-        filtered = self.df[self.df['category'] == category]
-        tx_df = filtered[['date', 'transaction_type', 'description', self.amount_col, 'essential']].copy()
-        tx_df.columns = ["Date", "Transaction Type", "Description", "Amount", "Essential"]
-        model = PandasModel(tx_df)
+        # paged from the database as the table scrolls, sorted by SQL
+        model = SqlTransactionModel(self.db_conn, self.amount_col, category, self.use_full_category,
+                                    self.essential_filter)
         self.table.setModel(model)
         self.table.resizeColumnsToContents()
+        self.category_label.setText(f"Transactions in category: {category} ({model.total_rows()})")
 
     def set_essential_filter(self, mode):
         # mode: 'ALL', 'Y', 'N'
@@ -188,9 +199,10 @@ class PieChartWithTable(QWidget):
 
 
 class MainWindow(QWidget):
-    def __init__(self, db_conn):
+    def __init__(self, db_conn, loader):
         super().__init__()
         self.db_conn = db_conn
+        self.loader = loader
         self.init_ui()
 
     def init_ui(self):
@@ -234,8 +246,8 @@ class MainWindow(QWidget):
 
         self.setLayout(main_layout)
 
-        self.pie_out = PieChartWithTable(self.db_conn, is_paid_out=True, use_full_category=True)
-        self.pie_in = PieChartWithTable(self.db_conn, is_paid_out=False, use_full_category=True)
+        self.pie_out = PieChartWithTable(self.db_conn, self.loader, is_paid_out=True, use_full_category=True)
+        self.pie_in = PieChartWithTable(self.db_conn, self.loader, is_paid_out=False, use_full_category=True)
 
         self.chart_container.addWidget(self.pie_out)
         self.chart_container.addWidget(self.pie_in)
@@ -281,7 +293,11 @@ class MainWindow(QWidget):
 def main():
     app = QApplication(sys.argv)
     db_conn = sqlite3.connect(DB_FILE)
-    main_win = MainWindow(db_conn)
+    ensure_indexes(db_conn)
+    # the pies are filled in by the loader thread once the window is up
+    loader = DataLoader(DB_FILE)
+    app.aboutToQuit.connect(loader.stop)
+    main_win = MainWindow(db_conn, loader)
     main_win.resize(1400, 800)
     main_win.show()
     sys.exit(app.exec())
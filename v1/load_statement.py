@@ -1,10 +1,117 @@
 import sqlite3
 import csv
+import codecs
 import re
 import sys
 import os
+from datetime import datetime
+from itertools import islice
 from pathlib import Path
 
+# Reads the raw Nationwide download directly: no need for preprocess.sh
+SNIFF_BYTES = 64 * 1024
+BATCH_SIZE = 1000
+# Account summary lines at the top of a download, before the real header
+SKIP_MARKERS = ('Account Name:', 'Account Balance:', 'Available Balance')
+# Date formats of bank downloads; a row whose date matches none of them is a
+# footer or notes line, not a transaction
+DATE_FORMATS = ('%d %b %Y', '%d %B %Y', '%d/%m/%Y', '%d/%m/%y', '%Y-%m-%d', '%d-%m-%Y')
+
+# Accepted header names for each column (compared case-insensitively)
+COLUMN_NAMES = {
+    'transaction_type': ['transaction type', 'transaction_type', 'type'],
+    'description': ['description'],
+    'paid_out': ['paid out', 'debit'],
+    'paid_in': ['paid in', 'credit'],
+    'balance': ['balance'],
+}
+
+
+def detect_encoding(path):
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        head.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if e.start >= len(head) - 3:
+            # a multi-byte character cut in half by the sniff window
+            return 'utf-8'
+        # Nationwide downloads are Latin-1 (the old iconv -f ISO-8859-1 step)
+        return 'iso-8859-1'
+
+
+def parse_amount(text):
+    text = (text or '').replace('£', '').replace(',', '').strip()
+    return float(text) if text else 0.0
+
+
+def is_date(text):
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(text, fmt)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def map_columns(header):
+    names = [h.strip().lower() for h in header]
+    columns = {}
+    # first column with 'date' in its name, as load_and_categorise.py does
+    columns['date'] = next((i for i, n in enumerate(names) if 'date' in n), None)
+    for key, candidates in COLUMN_NAMES.items():
+        columns[key] = next((names.index(c) for c in candidates if c in names), None)
+    return columns
+
+
+def read_statement(path):
+    """Stream (date, type, description, paid_out, paid_in, balance) rows from a raw CSV download.
+
+    Decodes, handles CRLF line endings, skips the account summary and blank
+    lines, finds the header row and strips £ signs, all in one pass. Rows
+    whose date cell is not a date (footers, notes) are skipped and counted.
+    """
+    encoding = detect_encoding(path)
+    with open(path, newline='', encoding=encoding, errors='replace') as f:
+        columns = None
+        skipped, example = 0, None
+        for row in csv.reader(f):
+            cells = [c.strip() for c in row]
+            if not any(cells) or cells[0].startswith(SKIP_MARKERS):
+                continue
+            if columns is None:
+                if any('date' in c.lower() for c in cells):
+                    columns = map_columns(cells)
+                continue
+
+            def cell(key):
+                i = columns[key]
+                return cells[i] if i is not None and i < len(cells) else ''
+
+            if not is_date(cell('date')):
+                # trailing notes rather than a transaction
+                skipped += 1
+                example = example or ','.join(cells)
+                continue
+            yield (
+                cell('date'),
+                cell('transaction_type'),
+                cell('description'),
+                parse_amount(cell('paid_out')),
+                parse_amount(cell('paid_in')),
+                parse_amount(cell('balance')),
+            )
+        if columns is None:
+            print(f"Warning: no header row with a date column found in '{path}'")
+        elif skipped:
+            print(f"Warning: skipped {skipped} row(s) without a date in '{path}', e.g. {example[:60]!r}")
+
 # Check if a filename was passed
 if len(sys.argv) < 2:
     print("Error: Please provide a CSV filename to load.")
@@ -68,21 +175,23 @@ CREATE TABLE categorised (
 )
 ''')
 
+# Indexes the GUIs use to page through one category's transactions
+cursor.execute('CREATE INDEX idx_transactions_date ON transactions (date)')
+cursor.execute('CREATE INDEX idx_categorised_category ON categorised (category, essential)')
+
 # === IMPORT CSV TO TRANSACTIONS ===
-with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        cursor.execute('''
-            INSERT INTO transactions (date, transaction_type, description, paid_out, paid_in, balance)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            row['Date'],
-            row['Transaction type'],
-            row['Description'],
-            float(row['Paid out'] or 0),
-            float(row['Paid in'] or 0),
-            float(row['Balance'] or 0)
-        ))
+rows = read_statement(csv_filename)
+inserted = 0
+while True:
+    batch = list(islice(rows, BATCH_SIZE))
+    if not batch:
+        break
+    cursor.executemany('''
+        INSERT INTO transactions (date, transaction_type, description, paid_out, paid_in, balance)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', batch)
+    inserted += len(batch)
+print(f"Imported {inserted} transactions.")
 
 # === INSERT DEFAULT CATEGORY ===
 cursor.execute('''
@@ -1,25 +1,33 @@
 import sys
 import sqlite3
-import pandas as pd
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTableWidget,
-    QTableWidgetItem, QCheckBox, QLabel, QSizePolicy
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTableView,
+    QCheckBox, QLabel, QSizePolicy
 )
 from PyQt6.QtCore import Qt
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from data_loader import DataLoader
+from txn_model import SqlTransactionModel, ensure_indexes
+
 DB_FILE = 'load_statement.db'
 
 class PieChartWithTable(QWidget):
-    def __init__(self, db_conn, is_paid_out=True, use_full_category=True):
+    def __init__(self, db_conn, loader, is_paid_out=True, use_full_category=True):
         super().__init__()
         self.db_conn = db_conn
+        self.loader = loader
         self.is_paid_out = is_paid_out
         self.use_full_category = use_full_category
+        self.key = 'paid_out' if is_paid_out else 'paid_in'
 
         self.current_selected_category = None
+        self.categories = []
+        self.wedges = []
         self.init_ui()
+        self.loader.loaded.connect(self.on_data_loaded)
+        self.loader.failed.connect(self.on_data_failed)
         self.refresh()
 
     def init_ui(self):
@@ -36,12 +44,10 @@ class PieChartWithTable(QWidget):
         self.ax = self.fig.add_subplot(111)
         layout.addWidget(self.canvas, 4)
 
-        # Table for transactions
-        self.table = QTableWidget()
+        # Table for transactions, paged from the database as it scrolls
+        self.table = QTableView()
+        self.table.setSortingEnabled(True)
         self.table.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        self.table.setColumnCount(4)
-        headers = ["Date", "Transaction Type", "Description", "Paid Out" if self.is_paid_out else "Paid In"]
-        self.table.setHorizontalHeaderLabels(headers)
         layout.addWidget(self.table, 3)
 
         self.setLayout(layout)
@@ -51,42 +57,44 @@ class PieChartWithTable(QWidget):
 
     def refresh(self):
         self.current_selected_category = None
-        self.table.clearContents()
-        self.table.setRowCount(0)
+        self.table.setModel(None)
         self.category_label.setText("Click a segment to see transactions")
         self.load_data()
-        self.draw_pie()
 
     def load_data(self):
         print(f"[DEBUG] Loading data with use_full_category={self.use_full_category}")
-        cursor = self.db_conn.cursor()
         amount_col = 'paid_out' if self.is_paid_out else 'paid_in'
 
-        query = f'''
-        SELECT t.id, t.date, t.transaction_type, t.description, t.{amount_col}, cg.category
-        FROM transactions t
-        LEFT JOIN categorised cg ON t.id = cg.transaction_id
-        WHERE t.{amount_col} > 0
-        '''
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        # queried and grouped on the loader's thread; a newer request supersedes this one
+        self.loader.request(self.key, amount_col, self.use_full_category)
+        self.show_message("Loading…")
 
-        self.df = pd.DataFrame(rows, columns=['id', 'date', 'transaction_type', 'description', amount_col, 'category'])
-        self.df['category'] = self.df['category'].fillna('Uncategorised')
+    def on_data_loaded(self, key, generation, grouped):
+        if key != self.key or not self.loader.is_current(key, generation):
+            return
+        grouped = grouped.sort_index()
+        self.categories = grouped.index.tolist()
+        self.sizes = grouped.values.tolist()
+        print(f"[DEBUG] Categories after grouping: {self.categories}")
+        self.draw_pie()
 
-        if not self.use_full_category:
-            self.df['category'] = self.df['category'].apply(lambda c: c.split(';')[0].strip())
+    def on_data_failed(self, key, generation, message):
+        if key != self.key or not self.loader.is_current(key, generation):
+            return
+        print(f"⚠️ Could not load transactions: {message}")
+        self.show_message("Could not load transactions")
 
-        self.grouped = self.df.groupby('category')[amount_col].sum()
-        self.categories = self.grouped.index.tolist()
-        self.sizes = self.grouped.values.tolist()
-        print(f"[DEBUG] Categories after grouping: {self.categories}")
+    def show_message(self, text):
+        self.categories = []
+        self.wedges = []
+        self.ax.clear()
+        self.ax.text(0.5, 0.5, text, ha='center', va='center')
+        self.canvas.draw_idle()
 
     def draw_pie(self):
         self.ax.clear()
         if not self.categories:
-            self.ax.text(0.5, 0.5, "No data", ha='center', va='center')
-            self.canvas.draw()
+            self.show_message("No data")
             return
 
         wedges, texts, autotexts = self.ax.pie(
@@ -114,28 +122,22 @@ class PieChartWithTable(QWidget):
         self.current_selected_category = category
         self.category_label.setText(f"Transactions in category: {category}")
 
-        filtered = self.df[self.df['category'] == category]
-        self.populate_table(filtered)
+        self.populate_table(category)
 
-    def populate_table(self, df_filtered):
+    def populate_table(self, category):
         amount_col = 'paid_out' if self.is_paid_out else 'paid_in'
-
-        MAX_ROWS = 200
-        if len(df_filtered) > MAX_ROWS:
-            df_filtered = df_filtered.head(MAX_ROWS)
-
-        self.table.setRowCount(len(df_filtered))
-        for row_idx, (_, row) in enumerate(df_filtered.iterrows()):
-            self.table.setItem(row_idx, 0, QTableWidgetItem(row['date']))
-            self.table.setItem(row_idx, 1, QTableWidgetItem(row['transaction_type']))
-            self.table.setItem(row_idx, 2, QTableWidgetItem(row['description']))
-            self.table.setItem(row_idx, 3, QTableWidgetItem(f"{row[amount_col]:.2f}"))
+        model = SqlTransactionModel(self.db_conn, amount_col, category, self.use_full_category,
+                                    amount_label="Paid Out" if self.is_paid_out else "Paid In")
+        self.table.setModel(model)
+        self.table.setColumnHidden(4, True)
+        self.category_label.setText(f"Transactions in category: {category} ({model.total_rows()})")
 
 
 class MainWindow(QWidget):
-    def __init__(self, db_conn):
+    def __init__(self, db_conn, loader):
         super().__init__()
         self.db_conn = db_conn
+        self.loader = loader
 
         self.init_ui()
 
@@ -150,13 +152,13 @@ class MainWindow(QWidget):
         self.checkbox.setChecked(True)
         left_layout.addWidget(self.checkbox)
 
-        self.pie_out = PieChartWithTable(self.db_conn, is_paid_out=True, use_full_category=True)
+        self.pie_out = PieChartWithTable(self.db_conn, self.loader, is_paid_out=True, use_full_category=True)
         left_layout.addWidget(self.pie_out)
 
         layout.addLayout(left_layout)
 
         # Right pie chart and table for paid_in (no checkbox, always full categories)
-        self.pie_in = PieChartWithTable(self.db_conn, is_paid_out=False, use_full_category=True)
+        self.pie_in = PieChartWithTable(self.db_conn, self.loader, is_paid_out=False, use_full_category=True)
         layout.addWidget(self.pie_in)
 
         self.setLayout(layout)
@@ -179,8 +181,13 @@ def main():
 
     # Connect to your SQLite DB (replace 'your_database.db' with your DB filename)
     db_conn = sqlite3.connect(DB_FILE)
+    ensure_indexes(db_conn)
+
+    # the pies are filled in by the loader thread once the window is up
+    loader = DataLoader(DB_FILE)
+    app.aboutToQuit.connect(loader.stop)
 
-    main_win = MainWindow(db_conn)
+    main_win = MainWindow(db_conn, loader)
     main_win.resize(1200, 700)
     main_win.show()
 
@@ -0,0 +1,136 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+# rows fetched from SQLite each time the view scrolls near the end
+PAGE_SIZE = 500
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)',
+    'CREATE INDEX IF NOT EXISTS idx_categorised_category ON categorised (category, essential)',
+]
+
+
+def ensure_indexes(conn):
+    """Add the indexes the GUIs page through, for databases loaded before they existed."""
+    for sql in INDEXES:
+        conn.execute(sql)
+    conn.commit()
+
+
+def category_filter(category, use_full_category):
+    """Join, SQL condition (on cg.category) and parameters selecting one pie segment.
+
+    A top-level category such as 'EATING OUT' also matches every
+    'EATING OUT;...' subcategory, written as a range so it can use the index.
+    Only Uncategorised needs the LEFT JOIN; an inner join lets SQLite start
+    from the category index.
+    """
+    if category == 'Uncategorised':
+        return 'LEFT JOIN', "(cg.category IS NULL OR cg.category = 'Uncategorised')", []
+    if use_full_category:
+        return 'JOIN', 'cg.category = ?', [category]
+    return ('JOIN', "(cg.category = ? OR (cg.category >= ? AND cg.category < ?))",
+            [category, category + ';', category + '<'])
+
+
+class SqlTransactionModel(QAbstractTableModel):
+    """Read-only transactions table that pages rows from SQLite as the view scrolls.
+
+    Sorting is done by SQL, and each page continues from the last row
+    fetched (keyset paging), so no page costs more than the first.
+    """
+
+    def __init__(self, db_conn, amount_col, category, use_full_category=True, essential_filter='ALL',
+                 amount_label="Amount", page_size=PAGE_SIZE):
+        super().__init__()
+        self.headers = ["Date", "Transaction Type", "Description", amount_label, "Essential"]
+        self.db_conn = db_conn
+        self.amount_col = amount_col
+        self.page_size = page_size
+        self._sort_columns = ['t.date', "COALESCE(t.transaction_type, '')", "COALESCE(t.description, '')",
+                              f't.{amount_col}', "COALESCE(cg.essential, 'N')"]
+        self._sort_column = 0
+        self._descending = False
+
+        self._join, where, params = category_filter(category, use_full_category)
+        self._where = [f't.{amount_col} > 0', where]
+        self._params = list(params)
+        if essential_filter in ('Y', 'N'):
+            self._where.append("COALESCE(cg.essential, 'N') = ?")
+            self._params.append(essential_filter)
+
+        self._rows = []
+        self._exhausted = False
+        self.fetchMore(QModelIndex())
+
+    def total_rows(self):
+        return self.db_conn.execute(f'''
+            SELECT count(*) FROM transactions t
+            {self._join} categorised cg ON t.id = cg.transaction_id
+            WHERE {' AND '.join(self._where)}
+        ''', self._params).fetchone()[0]
+
+    def _next_page(self):
+        sort_expr = self._sort_columns[self._sort_column]
+        where, params = list(self._where), list(self._params)
+        if self._rows:
+            # continue after the last row shown: (sort value, id) past the previous page
+            last = self._rows[-1]
+            where.append(f"({sort_expr}, t.id) {'<' if self._descending else '>'} (?, ?)")
+            params += [last[5], last[6]]
+        direction = 'DESC' if self._descending else 'ASC'
+        return self.db_conn.execute(f'''
+            SELECT t.date, t.transaction_type, t.description, t.{self.amount_col},
+                   COALESCE(cg.essential, 'N'), {sort_expr}, t.id
+            FROM transactions t
+            {self._join} categorised cg ON t.id = cg.transaction_id
+            WHERE {' AND '.join(where)}
+            ORDER BY {sort_expr} {direction}, t.id {direction}
+            LIMIT ?
+        ''', params + [self.page_size]).fetchall()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        page = self._next_page()
+        self._exhausted = len(page) < self.page_size
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(page) - 1)
+            self._rows.extend(page)
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self._rows[index.row()][index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == 3:
+                return f"{value or 0.0:.2f}"
+            return '' if value is None else str(value)
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 3:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def sort(self, column, order):
+        self.beginResetModel()
+        self._sort_column = column
+        self._descending = order == Qt.SortOrder.DescendingOrder
+        self._rows = []
+        self._exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
@@ -0,0 +1,201 @@
+import sqlite3
+import sys
+import os
+import argparse
+from collections import Counter, defaultdict
+
+import rule_cache
+import rule_guard
+from categorise_md import report_rule_checks
+from rule_match import prepare_text, search_prepared
+
+DB_FILE = 'load_statement.db'
+
+
+def replay(compiled_rules, pairs, skip=()):
+    """Every rule matching each (type, description) pair, in rule order.
+
+    Returns {pair: [rule indexes]}; the first index is the rule that
+    categorises the pair, any others are shadowed by it.
+    """
+    matches = {}
+    for txn_type, desc in pairs:
+        type_text, desc_text = prepare_text(txn_type), prepare_text(desc)
+        matches[(txn_type, desc)] = [
+            i for i, (type_compiled, desc_compiled) in enumerate(compiled_rules)
+            if i not in skip
+            and search_prepared(type_compiled, type_text) and search_prepared(desc_compiled, desc_text)
+        ]
+    return matches
+
+
+def analyse(category_rules, compiled_rules, pair_counts, skip=()):
+    """Per-rule hit counts and shadowing over the transaction history.
+
+    Returns a list with one dict per rule: 'hits' (transactions it
+    categorises), 'matched' (transactions it matches at all), 'shadowed_by'
+    (Counter of earlier rules that won those transactions instead) and
+    'duplicate_of' (index of an earlier rule with identical patterns, or None).
+    """
+    matches = replay(compiled_rules, list(pair_counts), skip)
+    stats = [{'hits': 0, 'matched': 0, 'shadowed_by': Counter(), 'duplicate_of': None}
+             for _ in category_rules]
+    for pair, rule_indexes in matches.items():
+        count = pair_counts[pair]
+        for n, i in enumerate(rule_indexes):
+            stats[i]['matched'] += count
+            if n == 0:
+                stats[i]['hits'] += count
+            else:
+                stats[i]['shadowed_by'][rule_indexes[0]] += count
+
+    first_seen = {}
+    for i, rule in enumerate(category_rules):
+        key = (rule[0].strip(), rule[1].strip())
+        if key in first_seen:
+            stats[i]['duplicate_of'] = first_seen[key]
+        else:
+            first_seen[key] = i
+    return stats
+
+
+def dead_rules(stats, quarantined=(), keep_unmatched=False):
+    """Rules that categorise nothing, so removing them changes nothing."""
+    return [i for i, s in enumerate(stats)
+            if s['hits'] == 0 and i not in quarantined
+            and (s['matched'] or s['duplicate_of'] is not None or not keep_unmatched)]
+
+
+def table_lines(path):
+    """Line numbers of the rule rows in a markdown table, in read_md_table() order."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [l.rstrip('\n') for l in f]
+    header_idx = next((i for i, l in enumerate(lines)
+                       if l.strip().startswith('|') and '|' in l.strip()[1:]), None)
+    rows = []
+    if header_idx is None:
+        return lines, rows
+    for n in range(header_idx + 2, len(lines)):
+        l = lines[n]
+        if not l.strip().startswith('|'):
+            break
+        if set(l.strip()) <= set('| -:'):
+            continue
+        rows.append(n)
+    return lines, rows
+
+
+def format_table(rows):
+    widths = [max([len(col)] + [len(r[col]) for r in rows]) for col in rule_cache.RULE_COLUMNS]
+    line = lambda cells: '| ' + ' | '.join(f'{c:<{w}}' for c, w in zip(cells, widths)) + ' |'
+    out = [line(rule_cache.RULE_COLUMNS), line(['-' * w for w in widths])]
+    out += [line([r[col] for col in rule_cache.RULE_COLUMNS]) for r in rows]
+    return out
+
+
+def write_pruned(infile, outfile, rows, drop):
+    """Write the rules file without the dropped rules; other lines are kept as they are."""
+    if infile.lower().endswith('.csv'):
+        lines = ['# Categories (pruned from %s)' % os.path.basename(infile), '']
+        lines += format_table([r for i, r in enumerate(rows) if i not in drop])
+    else:
+        lines, row_lines = table_lines(infile)
+        skip_lines = {row_lines[i] for i in drop}
+        lines = [l for n, l in enumerate(lines) if n not in skip_lines]
+    with open(outfile, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def print_report(category_rules, stats, quarantined, total):
+    describe = lambda i: rule_guard.format_rule(category_rules, i)
+    print(f"Replayed {total} transactions through {len(category_rules)} rules:\n")
+    for i, s in enumerate(stats):
+        line = f"{i + 1:>4}. {category_rules[i][0]} | {category_rules[i][1]}: {s['hits']} hit(s)"
+        if i in quarantined:
+            line += ' (quarantined, not applied)'
+        elif s['shadowed_by']:
+            line += f", {sum(s['shadowed_by'].values())} more taken by earlier rules"
+        print(line)
+
+    duplicates = [i for i, s in enumerate(stats) if s['duplicate_of'] is not None]
+    shadowed = [i for i, s in enumerate(stats) if s['hits'] == 0 and s['matched'] and s['duplicate_of'] is None]
+    unmatched = [i for i, s in enumerate(stats)
+                 if not s['matched'] and s['duplicate_of'] is None and i not in quarantined]
+
+    if duplicates:
+        print(f"\n⚠️  {len(duplicates)} rule(s) repeat the patterns of an earlier rule and can never fire:")
+        for i in duplicates:
+            print(f"  {describe(i)} duplicates {describe(stats[i]['duplicate_of'])}")
+    if shadowed:
+        print(f"\n⚠️  {len(shadowed)} rule(s) match transactions but are always beaten by an earlier rule:")
+        for i in shadowed:
+            winners = ', '.join(f"rule {w + 1} ({n})" for w, n in stats[i]['shadowed_by'].most_common())
+            print(f"  {describe(i)} shadowed by {winners}")
+    if unmatched:
+        print(f"\n{len(unmatched)} rule(s) matched no transactions at all:")
+        for i in unmatched:
+            print(f"  {describe(i)}")
+    if not (duplicates or shadowed or unmatched):
+        print("\n✅ Every rule categorises at least one transaction.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate, shadowed and unused category rules.")
+    parser.add_argument('infile', nargs='?', default='categories.md', help="Markdown table or CSV file with the category rules")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    parser.add_argument('--write-pruned', metavar='FILE',
+                        help="Write a copy of the rules without the rules that categorise nothing")
+    parser.add_argument('--keep-unmatched', action='store_true',
+                        help="Keep rules that match no transactions yet when pruning (e.g. for future payees)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.infile):
+        print(f"Error: '{args.infile}' not found")
+        sys.exit(1)
+    ruleset = rule_cache.load_rules(args.infile)
+    if not ruleset['rows']:
+        print('No rules found in', args.infile)
+        sys.exit(1)
+    category_rules = [tuple(r[col] for col in rule_cache.RULE_COLUMNS) for r in ruleset['rows']]
+
+    conn = sqlite3.connect(args.db)
+    cursor = conn.cursor()
+    pair_counts = defaultdict(int)
+    for txn_type, desc in cursor.execute('SELECT transaction_type, description FROM transactions'):
+        pair_counts[(txn_type, desc)] += 1
+    quarantined = report_rule_checks(cursor, category_rules, ruleset['issues'])
+    conn.close()
+
+    stats = analyse(category_rules, ruleset['compiled'], pair_counts, quarantined)
+    print_report(category_rules, stats, quarantined, sum(pair_counts.values()))
+
+    if args.write_pruned:
+        drop = set(dead_rules(stats, quarantined, args.keep_unmatched))
+        kept = [i for i in range(len(category_rules)) if i not in drop]
+        # the first matching rule is always kept, so every transaction should
+        # be categorised exactly as before; replay to prove it before writing
+        before = replay(ruleset['compiled'], list(pair_counts), quarantined)
+        after = replay([ruleset['compiled'][i] for i in kept], list(pair_counts),
+                       {kept.index(i) for i in quarantined})
+        category = lambda idx: category_rules[idx][2:] if idx is not None else None
+        changed = [p for p in pair_counts
+                   if category(before[p][0] if before[p] else None) != category(kept[after[p][0]] if after[p] else None)]
+        if changed:
+            print(f"\n⛔ The pruned rules would categorise {sum(pair_counts[p] for p in changed)} transaction(s) "
+                  f"differently, e.g. {changed[0][0]} | {changed[0][1]}; {args.write_pruned} not written.")
+            sys.exit(1)
+        write_pruned(args.infile, args.write_pruned, ruleset['rows'], drop)
+        print(f"\n✅ Replaying the history with the pruned rules gives identical categories; "
+              f"wrote {len(kept)} of {len(category_rules)} rules to {args.write_pruned}.")
+        # identical on past data, but a rule for a payee not seen yet (an
+        # annual payment, say) may be needed next year
+        unmatched = [i for i in sorted(drop) if not stats[i]['matched'] and stats[i]['duplicate_of'] is None]
+        if unmatched:
+            print(f"⚠️  {len(unmatched)} dropped rule(s) match no transaction yet and may be needed for future ones; "
+                  f"use --keep-unmatched to keep them:")
+            for i in unmatched:
+                print(f'  {rule_guard.format_rule(category_rules, i)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,74 +1,181 @@
-import sqlite3
-import re
 import sys
 import os
+import argparse
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import cube
+import db_build
+import queries
+import rollups
+import rule_cache
+import rule_guard
+import schema
+from rule_match import compile_pattern, pattern_search, compile_rules, match_rule, register_regexp
 
 
 def regex_search(pattern, text):
-    text = text or ''
-    pattern = pattern or ''
-    try:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    except re.error:
-        return False
-
-    try:
-        norm_pattern = re.sub(r'\s+', '', pattern)
-        norm_text = re.sub(r'\s+', '', text)
-        return bool(re.search(norm_pattern, norm_text, re.IGNORECASE))
-    except re.error:
-        return False
-
-
-def read_md_table(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        lines = [l.rstrip('\n') for l in f]
-
-    # find first table header line (starts with | and has | separators)
-    header_idx = None
-    for i, l in enumerate(lines):
-        if l.strip().startswith('|') and '|' in l.strip()[1:]:
-            header_idx = i
-            break
-
-    if header_idx is None or header_idx + 1 >= len(lines):
-        return [], []
-
-    header_line = lines[header_idx]
-    sep_line = lines[header_idx + 1]
-
-    # headers are the cells between | ... |
-    def split_row(line):
-        parts = [p.strip() for p in line.split('|')]
-        # remove leading/trailing empties caused by leading/trailing |
-        if parts and parts[0] == '':
-            parts = parts[1:]
-        if parts and parts[-1] == '':
-            parts = parts[:-1]
-        return parts
-
-    headers = split_row(header_line)
-
-    rows = []
-    for l in lines[header_idx + 2:]:
-        if not l.strip().startswith('|'):
-            # stop at first non-table line
-            break
-        # ignore separator-like lines
-        if set(l.strip()) <= set('| -:'):
-            continue
-        cells = split_row(l)
-        # pad to headers length
-        if len(cells) < len(headers):
-            cells += [''] * (len(headers) - len(cells))
-        rows.append(dict(zip(headers, cells)))
-
-    return headers, rows
+    # case-insensitive search, retried with all whitespace removed
+    return pattern_search(compile_pattern(pattern), text)
+
+
+# Below this many distinct payees, starting worker processes costs more than it saves
+PARALLEL_MIN_PAIRS = 2000
+
+_worker_rules = None
+_worker_skip = ()
+
+
+def _init_worker(compiled_rules, skip):
+    # runs once per worker process, so the rules are shipped only once
+    global _worker_rules, _worker_skip
+    _worker_rules = compiled_rules
+    _worker_skip = skip
+
+
+def _match_chunk(pairs):
+    return [match_rule(_worker_rules, t, d, _worker_skip) for t, d in pairs]
+
+
+def match_pairs(compiled_rules, pairs, skip=(), jobs=1):
+    """Return the first matching rule index (or None) for each (type, description) pair, in order."""
+    if jobs <= 1 or len(pairs) < PARALLEL_MIN_PAIRS:
+        return [match_rule(compiled_rules, t, d, skip) for t, d in pairs]
+
+    # several chunks per worker keeps them busy when some payees are slower to match
+    chunk_size = -(-len(pairs) // (jobs * 4))
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(compiled_rules, frozenset(skip))) as pool:
+        # map() yields in submission order, so results line up with pairs
+        for chunk_result in pool.map(_match_chunk, chunks):
+            results.extend(chunk_result)
+    return results
+
+
+def categorise_in_python(cursor, rule_ids, category_rules, compiled_rules=None, quarantined=(), jobs=1):
+    """Record the id of the first matching rule for every transaction (NULL if none)."""
+    cursor.execute(queries.CATEGORISE_TRANSACTIONS)
+    transactions = cursor.fetchall()
+    if compiled_rules is None:
+        compiled_rules = compile_rules(category_rules)
+
+    # many transactions share a payee, so each distinct one is matched once
+    pairs = list(dict.fromkeys((txn_type, desc) for _, txn_type, desc in transactions))
+    matches = dict(zip(pairs, match_pairs(compiled_rules, pairs, quarantined, jobs)))
+
+    categorised_rows = []
+    for txn_id, txn_type, desc in transactions:
+        idx = matches[(txn_type, desc)]
+        categorised_rows.append((txn_id, rule_ids[idx] if idx is not None else None))
+
+    cursor.executemany('INSERT INTO categorised (transaction_id, rule_id) VALUES (?, ?)', categorised_rows)
+    return len(categorised_rows)
+
+
+def categorise_in_sqlite(conn, skip_ids=()):
+    """Set-based categorisation: one INSERT ... SELECT using a REGEXP function.
+
+    Each transaction takes the first rule, in position order, whose patterns both match.
+    """
+    register_regexp(conn)
+    skip = ''
+    if skip_ids:
+        skip = 'AND c.id NOT IN (%s)' % ','.join(str(int(i)) for i in skip_ids)
+    cursor = conn.execute(f'''
+        INSERT INTO categorised (transaction_id, rule_id)
+        SELECT t.id, (
+            SELECT c.id FROM categories c
+            WHERE t.transaction_type REGEXP c.transaction_type_pattern
+              AND t.description REGEXP c.description_pattern
+              {skip}
+            ORDER BY c.position, c.id
+            LIMIT 1
+        )
+        FROM transactions t
+        ORDER BY t.id
+    ''')
+    return cursor.rowcount
+
+
+def sync_rules(cursor, rows):
+    """Make categories hold exactly rows, in order, keeping rule ids stable.
+
+    A rule whose patterns are already in the table keeps that row's id (its
+    category and notes are updated), new patterns get new ids, and rules no
+    longer in the file are deleted. AUTOINCREMENT means a deleted rule's id
+    is never handed to a different rule. Returns (kept, added, removed).
+    """
+    existing = defaultdict(list)
+    for rule_id, type_pattern, desc_pattern in cursor.execute(
+            'SELECT id, transaction_type_pattern, description_pattern FROM categories ORDER BY position, id').fetchall():
+        existing[(type_pattern, desc_pattern)].append(rule_id)
+
+    kept = added = 0
+    for position, row in enumerate(rows, 1):
+        values = tuple(row[col] for col in rule_cache.RULE_COLUMNS)
+        # duplicated patterns pair up with the existing duplicates in order
+        ids = existing.get(values[:2])
+        if ids:
+            cursor.execute(f'''
+                UPDATE categories SET {', '.join(f'{col} = ?' for col in rule_cache.RULE_COLUMNS)}, position = ?
+                WHERE id = ?
+            ''', values + (position, ids.pop(0)))
+            kept += 1
+        else:
+            cursor.execute(f'''
+                INSERT INTO categories ({', '.join(rule_cache.RULE_COLUMNS)}, position)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', values + (position,))
+            added += 1
+    removed = [rule_id for ids in existing.values() for rule_id in ids]
+    cursor.executemany('DELETE FROM categories WHERE id = ?', [(rule_id,) for rule_id in removed])
+    return kept, added, len(removed)
+
+
+def report_rule_checks(cursor, category_rules, issues, profile_all=False, budget=rule_guard.RULE_TIME_BUDGET):
+    """Report risky rules (rule_guard.check_rules output) and return the indexes of quarantined ones."""
+    if issues:
+        print(f'⚠️  {len(issues)} rule(s) look risky:')
+        for idx, problems in issues.items():
+            print(f'  {rule_guard.format_rule(category_rules, idx)}')
+            for p in problems:
+                print(f'      {p}')
+
+    # only rules that look dangerous are timed unless asked for all of them
+    indexes = None if profile_all else sorted(issues)
+    if indexes == []:
+        return set()
+    samples = rule_guard.sample_inputs(cursor)
+    over_budget, untimed = rule_guard.profile_rules(category_rules, samples, indexes, budget=budget)
+    if untimed:
+        print(f'⚠️  Rule profiling did not finish (the timing process never started); '
+              f'{len(untimed)} rule(s) were not timed and are applied unchecked:')
+        for idx in untimed:
+            print(f'  {rule_guard.format_rule(category_rules, idx)}')
+    if over_budget:
+        print(f'⛔ Quarantined {len(over_budget)} rule(s) over the {budget}s budget (not applied this run):')
+        for idx, elapsed in sorted(over_budget.items()):
+            took = 'killed, still running' if elapsed is None else f'{elapsed:.3f}s'
+            print(f'  {rule_guard.format_rule(category_rules, idx)}: {took} on {len(samples)} samples')
+    return set(over_budget)
 
 
 def main():
-    infile = sys.argv[1] if len(sys.argv) > 1 else 'categories.md'
+    parser = argparse.ArgumentParser(description="Load category rules from a markdown table (or CSV) and re-apply them.")
+    parser.add_argument('infile', nargs='?', default='categories.md', help="Markdown table or CSV file with the category rules")
+    parser.add_argument('--profile-rules', action='store_true', help="Time every rule on sample inputs, not just risky-looking ones")
+    parser.add_argument('--rule-budget', type=float, default=rule_guard.RULE_TIME_BUDGET,
+                        help="Seconds a rule may take over the sample inputs before it is quarantined")
+    parser.add_argument('--engine', choices=['python', 'sqlite'], default='python',
+                        help="Match rules in a Python loop, or inside SQLite with a REGEXP function")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Worker processes for matching rules (0 = one per CPU)")
+    args = parser.parse_args()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    infile = args.infile
 
     if not os.path.exists(infile):
         print(f"Error: '{infile}' not found")
@@ -76,92 +183,89 @@ def main():
 
     print(f"📂 Loading category rules from: {infile}")
 
-    headers, rows = read_md_table(infile)
-    if not headers:
+    ruleset = rule_cache.load_rules(infile)
+    if not ruleset['headers']:
         print('No table found in markdown')
         sys.exit(1)
-
-    # normalize header names to expected DB column names
-    # expected: transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes
-    expected = ['transaction_type_pattern', 'description_pattern', 'main_category', 'sub1', 'sub2', 'sub3', 'notes']
-
-    # map header positions
-    header_map = {h: h for h in headers}
+    unfinished = rule_cache.missing_category(ruleset['rows'])
+    if unfinished:
+        print(f"⛔ {len(unfinished)} rule(s) in {infile} have no main_category; fill them in first. Nothing was applied.")
+        for r in unfinished[:10]:
+            print(f"   {r['transaction_type_pattern']} / {r['description_pattern']}")
+        sys.exit(1)
 
     DB_FILE = 'load_statement.db'
     TRUNCATE_CATEGORIES = True
 
-    conn = sqlite3.connect(DB_FILE)
+    # work on a private copy and swap it in at the end, so readers never see
+    # an empty or half-filled categorised table
+    conn = db_build.open_build_db(DB_FILE, copy_existing=True)
     cursor = conn.cursor()
 
     # ensure the transactions table exists -- if not, user probably hasn't loaded statements yet
     cur_tables = [r[0] for r in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
     if 'transactions' not in cur_tables:
         print("Error: 'transactions' table not found in database. Run load_statement_ofx.py or load_and_categorise.py first.")
-        conn.close()
+        db_build.discard(conn)
         sys.exit(1)
 
-    if TRUNCATE_CATEGORIES:
-        # create categories table if missing, then truncate
-        if 'categories' not in cur_tables:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    transaction_type_pattern TEXT,
-                    description_pattern TEXT,
-                    main_category TEXT,
-                    sub1 TEXT,
-                    sub2 TEXT,
-                    sub3 TEXT,
-                    notes TEXT
-                )
-            ''')
-        print('Truncating existing category rules...')
-        cursor.execute('DELETE FROM categories')
-
-    for r in rows:
-        # extract values for expected columns, fallback to empty string
-        vals = [r.get(col, '') for col in expected]
-        cursor.execute('''
-            INSERT INTO categories (transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', tuple(vals))
+    # bring older databases (including v1 category/essential ones) up to the
+    # current tables and indexes
+    for step in schema.migrate(conn):
+        print(f'Upgraded database: {step}')
+
+    # what each rule assigned before this run, so the cube only recomputes
+    # the months that change
+    had_cube = cube.cube_exists(conn)
+    previous_keys = cube.rule_keys(conn)
+    previous_digest = cursor.execute('SELECT value FROM meta WHERE key = ?', (cube.APPLIED_RULES_KEY,)).fetchone()
+
+    loaded = cursor.execute("SELECT value FROM meta WHERE key = 'rules_hash'").fetchone()
+    if TRUNCATE_CATEGORIES and loaded and loaded[0] == ruleset['hash']:
+        print('Category rules unchanged since last run, keeping them.')
+    else:
+        if TRUNCATE_CATEGORIES:
+            kept, added, removed = sync_rules(cursor, ruleset['rows'])
+            print(f'Updated category rules: {kept} kept their ids, {added} added, {removed} removed.')
+        else:
+            start = cursor.execute('SELECT COALESCE(MAX(position), 0) FROM categories').fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO categories (transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes, position)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [tuple(r[col] for col in rule_cache.RULE_COLUMNS) + (start + n,)
+                  for n, r in enumerate(ruleset['rows'], 1)])
+        # only a truncated table holds exactly this rule file
+        cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rules_hash', ?)",
+                       (ruleset['hash'] if TRUNCATE_CATEGORIES else '',))
 
     # Re-apply categorisation (same logic as categorise.py)
     cursor.execute('DELETE FROM categorised')
 
-    cursor.execute('SELECT id, transaction_type, description FROM transactions')
-    transactions = cursor.fetchall()
-
-    cursor.execute('SELECT transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes FROM categories')
-    category_rules = cursor.fetchall()
+    cursor.execute(queries.CATEGORY_RULES)
+    rule_rows = cursor.fetchall()
+    rule_ids = [r[0] for r in rule_rows]
+    category_rules = [r[1:] for r in rule_rows]
 
-    for txn_id, txn_type, desc in transactions:
-        matched_main_category = 'Uncategorised'
-        matched_sub1 = ''
-        matched_sub2 = ''
-        matched_sub3 = ''
-        matched_notes = ''
-        for type_pattern, desc_pattern, main_category, sub1, sub2, sub3, notes in category_rules:
-            type_pattern = type_pattern or ''
-            desc_pattern = desc_pattern or ''
-            type_match = regex_search(type_pattern, txn_type)
-            desc_match = regex_search(desc_pattern, desc)
-            if type_match and desc_match:
-                matched_main_category = main_category or ''
-                matched_sub1 = sub1 or ''
-                matched_sub2 = sub2 or ''
-                matched_sub3 = sub3 or ''
-                matched_notes = notes or ''
-                break
-
-        cursor.execute('''
-            INSERT INTO categorised (transaction_id, main_category, sub1, sub2, sub3, notes)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (txn_id, matched_main_category, matched_sub1, matched_sub2, matched_sub3, matched_notes))
-
-    conn.commit()
-    conn.close()
+    if TRUNCATE_CATEGORIES:
+        issues, compiled_rules = ruleset['issues'], ruleset['compiled']
+    else:
+        issues, compiled_rules = rule_guard.check_rules(category_rules), compile_rules(category_rules)
+    quarantined = report_rule_checks(cursor, category_rules, issues, args.profile_rules, args.rule_budget)
+
+    start = time.perf_counter()
+    if args.engine == 'sqlite':
+        count = categorise_in_sqlite(conn, [rule_ids[i] for i in quarantined])
+    else:
+        count = categorise_in_python(cursor, rule_ids, category_rules, compiled_rules, quarantined, jobs)
+    print(f'Categorised {count} transactions in {time.perf_counter() - start:.3f}s ({args.engine} engine)')
+    rollups.rebuild_rollups(conn)
+    digest = cube.applied_rules_digest(rule_rows, [rule_ids[i] for i in quarantined])
+    months = cube.changed_months(conn, previous_keys, previous_digest and previous_digest[0], digest) if had_cube else None
+    cells = cube.refresh_cube(conn, months)
+    cursor.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (cube.APPLIED_RULES_KEY, digest))
+    print(f"Cube: {'rebuilt' if months is None else f'refreshed {len(months)} changed month(s)'}, {cells} cells written")
+
+    db_build.publish(conn, DB_FILE)
     print('Category rules (from MD) updated and applied successfully.')
 
 
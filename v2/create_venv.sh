@@ -6,5 +6,5 @@ sudo apt install -y python3-venv
 python3 -m venv bankenv
 
 source bankenv/bin/activate
-pip install PyQt6 matplotlib pandas
+pip install PyQt6 matplotlib pandas numpy pyarrow
 
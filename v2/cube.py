@@ -0,0 +1,260 @@
+import sqlite3
+import json
+import hashlib
+import argparse
+
+import db_build
+import schema
+
+DB_FILE = 'load_statement.db'
+CUBE_TABLE = 'category_cube'
+DIMENSIONS = ['month', 'account', 'main_category', 'sub1', 'sub2']
+# meta key holding applied_rules_digest() of the last categorisation
+APPLIED_RULES_KEY = 'applied_rules'
+
+# one row per transaction with its cube coordinates
+_CELLS = '''
+    SELECT t.id,
+           t.date,
+           substr(t.date, 1, 7) AS month,
+           COALESCE(t.account, '') AS account,
+           COALESCE(r.main_category, 'Uncategorised') AS main_category,
+           COALESCE(r.sub1, '') AS sub1,
+           COALESCE(r.sub2, '') AS sub2,
+           CAST(round(COALESCE(t.paid_out, 0) * 100) AS INTEGER) AS out_pence,
+           CAST(round(COALESCE(t.paid_in, 0) * 100) AS INTEGER) AS in_pence
+    FROM transactions t
+    LEFT JOIN categorised c ON c.transaction_id = t.id
+    LEFT JOIN categories r ON r.id = c.rule_id
+    WHERE COALESCE(t.date, '') != ''
+'''
+
+# months with a transaction categorised by any of a JSON list of rule ids
+RULE_MONTHS = '''
+    SELECT DISTINCT substr(t.date, 1, 7)
+    FROM categorised c
+    JOIN transactions t ON t.id = c.transaction_id
+    WHERE c.rule_id IN (SELECT value FROM json_each(?))
+      AND COALESCE(t.date, '') != ''
+'''
+
+
+def shift_month(month, delta):
+    """'2024-03' moved by delta months, e.g. shift_month('2024-03', -12) == '2023-03'."""
+    year, mon = int(month[:4]), int(month[5:7])
+    index = year * 12 + mon - 1 + delta
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def cube_exists(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (CUBE_TABLE,)
+    ).fetchone() is not None
+
+
+def refresh_cube(conn, months=None):
+    """Recompute the cube cells for the given months ('YYYY-MM'), or all of it.
+
+    The cube holds money out, money in (both in pence) and the transaction
+    count per month x account x main_category x sub1 x sub2. Returns the
+    number of cells written.
+    """
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {CUBE_TABLE} (
+            month TEXT,
+            account TEXT,
+            main_category TEXT,
+            sub1 TEXT,
+            sub2 TEXT,
+            out_pence INTEGER,
+            in_pence INTEGER,
+            txn_count INTEGER,
+            PRIMARY KEY (month, account, main_category, sub1, sub2)
+        ) WITHOUT ROWID
+    ''')
+    if months is None:
+        conn.execute(f'DELETE FROM {CUBE_TABLE}')
+    else:
+        conn.execute(f'DELETE FROM {CUBE_TABLE} WHERE month IN (SELECT value FROM json_each(?))',
+                     (json.dumps(sorted(months)),))
+    sql, params = cells_sql(months)
+    cursor = conn.execute(f'''
+        INSERT INTO {CUBE_TABLE} (month, account, main_category, sub1, sub2, out_pence, in_pence, txn_count)
+        {sql}
+    ''', params)
+    return cursor.rowcount
+
+
+def cells_sql(months=None):
+    """The query and parameters computing refresh_cube()'s cells for months (or all)."""
+    where, params = '', []
+    if months is not None:
+        months = sorted(months) or ['0000-00']
+        # the date range lets SQLite read just those months from idx_transactions_date
+        where = 'WHERE date >= ? AND date < ? AND month IN (SELECT value FROM json_each(?))'
+        params = [months[0], shift_month(months[-1], 1), json.dumps(months)]
+    return f'''
+        SELECT month, account, main_category, sub1, sub2, sum(out_pence), sum(in_pence), count(*)
+        FROM ({_CELLS})
+        {where}
+        GROUP BY month, account, main_category, sub1, sub2
+    ''', params
+
+
+def rebuild_cube(db_file):
+    """Recompute the whole cube in a build copy of db_file and swap it in."""
+    conn = db_build.open_build_db(db_file, copy_existing=True)
+    cells = refresh_cube(conn)
+    db_build.publish(conn, db_file)
+    return cells
+
+
+def rule_keys(conn):
+    """{rule id: (main_category, sub1, sub2)}, the cube coordinates each rule assigns."""
+    return {r[0]: r[1:] for r in conn.execute('SELECT id, main_category, sub1, sub2 FROM categories')}
+
+
+def applied_rules_digest(rule_rows, skipped_ids=()):
+    """Digest of the rules a categorisation applied: ids and patterns, in order.
+
+    rule_rows are queries.CATEGORY_RULES rows; skipped_ids are the rules
+    quarantined for the run. Two runs with the same digest give every
+    transaction the same rule id.
+    """
+    applied = [r[:3] for r in rule_rows if r[0] not in set(skipped_ids)]
+    return hashlib.sha256(json.dumps(applied).encode('utf-8')).hexdigest()
+
+
+def changed_months(conn, previous_keys, previous_digest, digest):
+    """Months whose cells a re-categorisation changed, or None to rebuild the whole cube.
+
+    When the applied rules are the same as last time (equal digests) each
+    transaction kept its rule, so only months holding transactions of rules
+    whose category changed need recomputing; they come from the rule index.
+    previous_keys is rule_keys() from before the rules were updated.
+    """
+    if previous_digest is None or previous_digest != digest:
+        return None
+    changed = [rule_id for rule_id, key in rule_keys(conn).items() if previous_keys.get(rule_id) != key]
+    if not changed:
+        return set()
+    return {m for (m,) in conn.execute(RULE_MONTHS, (json.dumps(changed),))}
+
+
+def _where(start=None, end=None, **filters):
+    clauses, params = [], []
+    if start:
+        clauses.append('month >= ?')
+        params.append(start)
+    if end:
+        clauses.append('month <= ?')
+        params.append(end)
+    for dim, value in filters.items():
+        if dim not in DIMENSIONS:
+            raise ValueError(f'unknown cube dimension: {dim}')
+        if value is not None:
+            clauses.append(f'{dim} = ?')
+            params.append(value)
+    return ' AND '.join(clauses) or '1', params
+
+
+def slice_sql(by=('main_category',), start=None, end=None, **filters):
+    """The query and parameters behind slice_cube()."""
+    for dim in by:
+        if dim not in DIMENSIONS:
+            raise ValueError(f'unknown cube dimension: {dim}')
+    where, params = _where(start, end, **filters)
+    columns = ', '.join(by)
+    select = f'{columns}, ' if by else ''
+    group = f'GROUP BY {columns}' if by else ''
+    return f'''
+        SELECT {select}sum(out_pence), sum(in_pence), sum(txn_count)
+        FROM {CUBE_TABLE}
+        WHERE {where}
+        {group}
+    ''', params
+
+
+def slice_cube(conn, by=('main_category',), start=None, end=None, **filters):
+    """Roll the cube up to the dimensions in by, over months start..end (inclusive).
+
+    Any other dimension can be fixed with a keyword filter, e.g.
+    slice_cube(conn, by=('sub1',), main_category='WANT'). Returns
+    {key tuple: (money out, money in, count)} in pounds.
+    """
+    sql, params = slice_sql(by, start, end, **filters)
+    rows = conn.execute(sql, params).fetchall()
+    return {tuple(r[:len(by)]): (r[-3] / 100, r[-2] / 100, r[-1])
+            for r in rows if r[-1]}
+
+
+def compare(current, previous):
+    """Pair two slice_cube() results: [(key, this out, previous out, change, % change)], biggest spend first."""
+    result = []
+    for key in set(current) | set(previous):
+        now = current.get(key, (0.0, 0.0, 0))[0]
+        before = previous.get(key, (0.0, 0.0, 0))[0]
+        change = now - before
+        result.append((key, now, before, change, change / before * 100 if before else None))
+    result.sort(key=lambda r: (-max(r[1], r[2]), r[0]))
+    return result
+
+
+def period_over_period(conn, month, by=('main_category',), lag=12, **filters):
+    """Money out in month against lag months earlier (12 = same month last year, 1 = last month)."""
+    earlier = shift_month(month, -lag)
+    return compare(slice_cube(conn, by, month, month, **filters),
+                   slice_cube(conn, by, earlier, earlier, **filters))
+
+
+def trailing(conn, end_month, months=12, by=('sub1',), **filters):
+    """The months up to end_month against the same window a year earlier."""
+    start = shift_month(end_month, 1 - months)
+    return compare(slice_cube(conn, by, start, end_month, **filters),
+                   slice_cube(conn, by, shift_month(start, -12), shift_month(end_month, -12), **filters))
+
+
+def latest_month(conn):
+    return conn.execute(f'SELECT max(month) FROM {CUBE_TABLE}').fetchone()[0]
+
+
+def print_comparison(rows, title):
+    print(title)
+    for key, now, before, change, pct in rows:
+        label = ' / '.join(k for k in key if k) or '(none)'
+        pct_text = f'{pct:+.1f}%' if pct is not None else 'new'
+        print(f'  {label:<40} £{now:>10,.2f}  was £{before:>10,.2f}  {change:>+11,.2f}  {pct_text}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Period comparisons from the category cube.")
+    parser.add_argument('--month', help="Month to compare (YYYY-MM); defaults to the latest month")
+    parser.add_argument('--lag', type=int, default=12, help="Months back to compare with (12 = same month last year)")
+    parser.add_argument('--trailing', type=int, metavar='N', help="Compare the N months up to --month with a year earlier")
+    parser.add_argument('--by', nargs='+', default=['main_category'], choices=DIMENSIONS[1:],
+                        help="Dimensions to break the totals down by")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the whole cube first")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.require_current(conn, args.db)
+    if args.rebuild:
+        print(f'Rebuilt {rebuild_cube(args.db)} cube cells.')
+    else:
+        schema.require_derived(conn, args.db, [CUBE_TABLE])
+    month = args.month or latest_month(conn)
+    if not month:
+        print('No transactions in the cube.')
+    elif args.trailing:
+        start = shift_month(month, 1 - args.trailing)
+        print_comparison(trailing(conn, month, args.trailing, args.by),
+                         f'Money out {start} to {month} vs a year earlier:')
+    else:
+        print_comparison(period_over_period(conn, month, args.by, args.lag),
+                         f'Money out in {month} vs {shift_month(month, -args.lag)}:')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+
+# Build in RAM by default; set to False to build in a side-by-side file
+# instead (useful when the database is too big to hold in memory).
+BUILD_IN_MEMORY = True
+BUILD_SUFFIX = '.building'
+
+# Safe only because the build database is private and thrown away on failure
+BULK_PRAGMAS = (
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA locking_mode = EXCLUSIVE',
+)
+
+
+def _main_file(conn):
+    # '' for an in-memory database
+    for _, name, path in conn.execute('PRAGMA database_list').fetchall():
+        if name == 'main':
+            return path or ''
+    return ''
+
+
+def open_build_db(db_file, copy_existing=False, in_memory=None):
+    """Open a private database to build into; call publish() when complete.
+
+    Readers of db_file keep seeing the old contents until publish() swaps
+    the finished database in, and a crash part way through leaves db_file
+    untouched. With copy_existing the build starts from a copy of db_file.
+    """
+    if in_memory is None:
+        in_memory = BUILD_IN_MEMORY
+
+    if in_memory:
+        conn = sqlite3.connect(':memory:')
+    else:
+        build_file = db_file + BUILD_SUFFIX
+        if os.path.exists(build_file):
+            # left over from a crashed run
+            os.remove(build_file)
+        conn = sqlite3.connect(build_file)
+
+    if copy_existing and os.path.exists(db_file):
+        src = sqlite3.connect(db_file)
+        try:
+            src.backup(conn)
+        finally:
+            src.close()
+
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def publish(conn, db_file):
+    """Commit the build database and swap it into place as db_file."""
+    conn.commit()
+    build_file = _main_file(conn)
+
+    if not build_file:
+        # The backup API copies every page in a single step inside one write
+        # transaction, so readers see either the old or the new database.
+        dst = sqlite3.connect(db_file)
+        try:
+            conn.backup(dst)
+        finally:
+            dst.close()
+            conn.close()
+        return
+
+    conn.close()
+    try:
+        os.replace(build_file, db_file)
+    except PermissionError:
+        # Windows will not replace a file another process has open, so fall
+        # back to copying the pages across with the backup API.
+        src = sqlite3.connect(build_file)
+        dst = sqlite3.connect(db_file)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        os.remove(build_file)
+
+
+def discard(conn):
+    """Throw away a build database without touching the live one."""
+    build_file = _main_file(conn)
+    conn.close()
+    if build_file and os.path.exists(build_file):
+        os.remove(build_file)
@@ -1,13 +1,40 @@
 import sqlite3
 import json
 import os
+import re
+import zlib
+import gzip
+import hashlib
+import argparse
 from datetime import datetime
 from collections import defaultdict, OrderedDict
 
+import numpy as np
+import plotly
 import plotly.graph_objects as go
+import plotly.offline
+
+try:
+    import brotli
+except ImportError:  # optional; gzip copies are always written
+    brotli = None
+
+import cube
+import queries
+import rollups
+import schema
+import txn_arrays
 
 DB_FILE = 'load_statement.db'
 OUTPUT_FILE = 'display.html'
+# Bump whenever make_html() or the figure layout changes, so reports built
+# by the old code are not mistaken for up to date
+TEMPLATE_VERSION = 3
+SITE_MANIFEST = 'manifest.json'
+# the Plotly library, written once and shared by every report that links to it
+ASSETS_DIR = 'assets'
+PLOTLY_ASSET = 'plotly.min.js'
+_FINGERPRINT = re.compile(r'<meta name="report-fingerprint" content="([0-9a-f]+)"')
 
 COLOR_PALETTE = [
     '#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A', '#19D3F3',
@@ -16,67 +43,102 @@ COLOR_PALETTE = [
 ]
 
 
-def parse_month(date_text):
-    if not date_text:
-        return ''
-    date_text = date_text.strip()
-    for fmt in ('%Y-%m-%d', '%Y%m%d', '%Y-%m', '%Y/%m/%d', '%d/%m/%Y'):
-        try:
-            dt = datetime.strptime(date_text[:10], fmt)
-            return dt.strftime('%Y-%m')
-        except ValueError:
-            continue
-    if len(date_text) >= 7:
-        return date_text[:7]
-    return date_text
-
-
-def load_transactions(db_file):
+def load_category_rollups(db_file):
     with sqlite3.connect(db_file) as conn:
-        cur = conn.cursor()
-        cur.execute(
-            '''
-            SELECT t.date, c.main_category, c.sub1, t.description, t.paid_in, t.paid_out
-            FROM transactions t
-            JOIN categorised c ON c.transaction_id = t.id
-            ORDER BY t.date
-            '''
-        )
-        return cur.fetchall()
+        return rollups.load_rollups(conn)
+
 
+def build_aggregates(rollup_rows):
+    """Monthly net amount per (main_category, sub1) from the precomputed rollups.
 
-def build_aggregates(rows):
+    Money under a main_category that has no sub1 is charted as '(no sub1)'.
+    """
     months = OrderedDict()
     data = defaultdict(lambda: defaultdict(float))
-    detail_map = defaultdict(lambda: defaultdict(list))
     all_main_categories = []
     all_sub1 = []
+    remainder = {}
 
-    for date_text, main_category, sub1, description, paid_in, paid_out in rows:
-        month = parse_month(date_text)
-        if month == '':
+    for month, path, depth, parent, label, out_pence, in_pence, count in rollup_rows:
+        if depth > 2:
             continue
         if month not in months:
             months[month] = None
-        main_category = main_category or 'Uncategorised'
-        sub1 = sub1 or '(no sub1)'
-        amount = (paid_in or 0.0) - (paid_out or 0.0)
+        net = in_pence - out_pence
+        if depth == 1:
+            remainder[(month, path)] = [label, net, count]
+            if label not in all_main_categories:
+                all_main_categories.append(label)
+            continue
+        main_category = remainder[(month, parent)][0]
+        remainder[(month, parent)][1] -= net
+        remainder[(month, parent)][2] -= count
+        data[(main_category, label)][month] += net / 100
+        if label not in all_sub1:
+            all_sub1.append(label)
+
+    for (month, _), (main_category, net, count) in remainder.items():
+        if count:
+            data[(main_category, '(no sub1)')][month] += net / 100
+            if '(no sub1)' not in all_sub1:
+                all_sub1.append('(no sub1)')
+
+    return list(months.keys()), all_main_categories, all_sub1, data
+
+
+def load_comparisons(db_file, months):
+    """Cube comparisons per month: against last month, the same month last year,
+    and the trailing 12 months by sub1 against the year before."""
+    def rows(result):
+        return [[' / '.join(k for k in key if k) or '(none)', round(now, 2), round(before, 2), round(change, 2),
+                 None if pct is None else round(pct, 1)]
+                for key, now, before, change, pct in result]
+
+    with sqlite3.connect(db_file) as conn:
+        return {month: {
+            'mom': rows(cube.period_over_period(conn, month, lag=1)),
+            'yoy': rows(cube.period_over_period(conn, month, lag=12)),
+            'trailing': rows(cube.trailing(conn, month, 12, by=('main_category', 'sub1'))),
+        } for month in months}
+
+
+def build_detail_map(data):
+    """Transactions per month and sub1, for the table shown when a bar is clicked.
 
-        key = (main_category, sub1)
-        data[key][month] += amount
-        detail_map[month][sub1].append({
+    data is txn_arrays.load_arrays() output; columns are converted in bulk
+    rather than row by row.
+    """
+    rows = data['rows']
+    dates = np.datetime_as_string(rows['day'].astype('datetime64[D]')).tolist()
+    main_names = np.array(data['main_category'], dtype=object)[rows['main_category']].tolist()
+    sub1_names = np.array([s or '(no sub1)' for s in data['sub1']], dtype=object)[rows['sub1']].tolist()
+    amounts = (rows['amount'] / 100).tolist()
+
+    detail_map = defaultdict(lambda: defaultdict(list))
+    for date_text, main_category, sub1, description, amount in zip(
+            dates, main_names, sub1_names, data['description'].tolist(), amounts):
+        detail_map[date_text[:7]][sub1].append({
             'date': date_text,
-            'description': description or '',
+            'description': description,
             'main_category': main_category,
             'sub1': sub1,
             'amount': amount,
         })
-        if main_category not in all_main_categories:
-            all_main_categories.append(main_category)
-        if sub1 not in all_sub1:
-            all_sub1.append(sub1)
+    return detail_map
 
-    return list(months.keys()), all_main_categories, all_sub1, data, detail_map
+
+def build_sunburst_data(rollup_rows):
+    """Rollup nodes per month, plus 'all' summed across months, for the drill-down chart."""
+    by_month = defaultdict(list)
+    totals = OrderedDict()
+    for month, path, depth, parent, label, out_pence, in_pence, count in rollup_rows:
+        by_month[month].append([path, parent, label, out_pence, in_pence, count])
+        node = totals.setdefault(path, [path, parent, label, 0, 0, 0])
+        node[3] += out_pence
+        node[4] += in_pence
+        node[5] += count
+    by_month['all'] = list(totals.values())
+    return by_month
 
 
 def format_month_label(month):
@@ -88,7 +150,8 @@ def format_month_label(month):
 
 
 def choose_color(sub1, palette):
-    return palette[hash(sub1) % len(palette)]
+    # crc32 rather than hash(), which is salted per process
+    return palette[zlib.crc32(sub1.encode('utf-8')) % len(palette)]
 
 
 def build_figure(months, data, all_sub1):
@@ -130,15 +193,116 @@ def build_figure(months, data, all_sub1):
     return fig, trace_info
 
 
-def make_html(fig, trace_info, main_categories, detail_map):
-    plot_div = fig.to_html(full_html=False, include_plotlyjs=True, div_id='display_plot')
+def month_fingerprints(db_file):
+    """{'YYYY-MM': hash of that month's transactions with their categories}.
+
+    These are the rows the detail tables, rollups and cube are built from,
+    so two databases with the same content give the same hashes however
+    they were loaded.
+    """
+    digests = {}
+    with sqlite3.connect(db_file) as conn:
+        cursor = conn.execute(queries.TRANSACTIONS_WITH_CATEGORIES)
+        while True:
+            batch = cursor.fetchmany(txn_arrays.FETCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                month = row[1][:7]
+                digest = digests.get(month) or digests.setdefault(month, hashlib.sha256())
+                digest.update(repr(row).encode('utf-8'))
+    return {month: digest.hexdigest() for month, digest in digests.items()}
+
+
+def page_fingerprint(kind, months, fingerprints):
+    """A hash of the months a page shows plus the code that renders it
+    (TEMPLATE_VERSION and the Plotly version)."""
+    digest = hashlib.sha256(f'{TEMPLATE_VERSION}|{plotly.__version__}|{kind}'.encode('utf-8'))
+    for month in months:
+        digest.update(f'|{month}:{fingerprints[month]}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def db_fingerprint(db_file, kind='dashboard'):
+    """The fingerprint of the single-file report: every month in the database."""
+    fingerprints = month_fingerprints(db_file)
+    return page_fingerprint(kind, sorted(fingerprints), fingerprints)
+
+
+def precompress(path, data):
+    """Write gzip (and, with brotli installed, brotli) copies of data next to path for serve.py."""
+    with open(path + '.gz', 'wb') as f:
+        # mtime=0 keeps the bytes identical between builds
+        f.write(gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+
+
+def write_output(path, text, compress=False):
+    data = text.encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(data)
+    if compress:
+        precompress(path, data)
+
+
+def remove_output(path):
+    for suffix in ('', '.gz', '.br'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def write_plotly_asset(out_dir):
+    """Put the Plotly library in out_dir/assets/ with compressed copies, unless it is already there.
+
+    Returns True when the file was (re)written.
+    """
+    path = os.path.join(out_dir, ASSETS_DIR, PLOTLY_ASSET)
+    data = plotly.offline.get_plotlyjs().encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            current = f.read()
+    except OSError:
+        current = None
+    if current == data and os.path.exists(path + '.gz'):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    precompress(path, data)
+    return True
+
+
+def built_fingerprint(path):
+    """The fingerprint recorded in a report written by make_html(), or None."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            head = f.read(2048)
+    except OSError:
+        return None
+    m = _FINGERPRINT.search(head)
+    return m.group(1) if m else None
+
+
+def make_html(fig, trace_info, main_categories, detail_map, sunburst_data, months, comparisons, fingerprint='',
+              title='Bank Statement Dashboard', nav_html='', plotlyjs=True):
+    """The dashboard page. plotlyjs=True embeds the Plotly library; a path such
+    as 'assets/plotly.min.js' links to a shared copy instead."""
+    # pages without comparisons (the static site's) keep the panel hidden
+    compare_style = '' if comparisons else ' style="display: none"'
+    comparisons = comparisons or {}
+    plot_div = fig.to_html(full_html=False, include_plotlyjs=plotlyjs, div_id='display_plot')
+    month_options = '<option value="all">All months</option>' + ''.join(
+        f'<option value="{m}">{format_month_label(m)}</option>' for m in reversed(months))
     checkbox_html = ''.join([f'<label><input type="checkbox" class="main-toggle" data-main="{mc}" checked> {mc}</label>' for mc in main_categories])
     script = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
 <meta charset="utf-8" />
-<title>Bank Statements Display</title>
+<meta name="report-fingerprint" content=\"""" + fingerprint + """\" />
+<title>""" + title + """</title>
 <style>
  body { font-family: Arial, sans-serif; margin: 20px; }
  .controls { margin-bottom: 16px; }
@@ -148,10 +312,18 @@ def make_html(fig, trace_info, main_categories, detail_map):
  th, td { border: 1px solid #ccc; padding: 8px; text-align: left; }
  th { background: #f2f2f2; }
  .note { color: #555; margin-top: 8px; }
+ #search-panel { margin-top: 32px; }
+ #hierarchy-panel { margin-top: 32px; }
+ #hierarchy-panel select { margin-right: 12px; }
+ #compare-panel { margin-top: 32px; }
+ #compare-panel select { margin-right: 12px; }
+ td.num { text-align: right; }
+ #search-box { width: 320px; padding: 6px; }
 </style>
 </head>
 <body>
-<h1>Bank Statement Dashboard</h1>
+<h1>""" + title + """</h1>
+""" + nav_html + """
 <div class="controls">
   <strong>Toggle main_category:</strong><br />
   """ + checkbox_html + """
@@ -170,10 +342,48 @@ def make_html(fig, trace_info, main_categories, detail_map):
     <tbody></tbody>
   </table>
 </div>
+<div id="hierarchy-panel">
+  <h2>Category breakdown</h2>
+  <p class="note">All four category levels (main_category, sub1, sub2, sub3). Click a segment to drill down, and the centre to go back up.</p>
+  <select id="sunburst-month">""" + month_options + """</select>
+  <select id="sunburst-flow">
+    <option value="out">Money out</option>
+    <option value="in">Money in</option>
+  </select>
+  <div id="sunburst_plot"></div>
+</div>
+<div id="compare-panel\"""" + compare_style + """>
+  <h2>Comparisons</h2>
+  <select id="compare-month">""" + ''.join(f'<option value="{m}">{format_month_label(m)}</option>' for m in reversed(months)) + """</select>
+  <select id="compare-view">
+    <option value="yoy">vs same month last year</option>
+    <option value="mom">vs previous month</option>
+    <option value="trailing">Trailing 12 months by sub1 vs year before</option>
+  </select>
+  <table id="compare-table">
+    <thead>
+      <tr><th>Category</th><th>Money out</th><th>Compared with</th><th>Change</th><th>%</th></tr>
+    </thead>
+    <tbody></tbody>
+  </table>
+</div>
+<div id="search-panel">
+  <h2>Search transactions</h2>
+  <input id="search-box" type="search" placeholder="Payee, e.g. TESCO" />
+  <p class="note" id="search-status">Type part of a payee name. Run serve.py to search the whole database.</p>
+  <table id="search-table">
+    <thead>
+      <tr><th>Date</th><th>Main category</th><th>sub1</th><th>Description</th><th>Amount</th></tr>
+    </thead>
+    <tbody></tbody>
+  </table>
+</div>
 <script>
 const mainCategoryToTraces = {};
 const traceInfo = """ + json.dumps(trace_info) + """;
 const detailMap = """ + json.dumps(detail_map) + """;
+const sunburstData = """ + json.dumps(sunburst_data) + """;
+const comparisons = """ + json.dumps(comparisons) + """;
 
 traceInfo.forEach((info, idx) => {
     if (!mainCategoryToTraces[info.main_category]) {
@@ -254,6 +464,102 @@ plotElement.on('plotly_click', function(event) {
       ? `Transactions for ${sub1} in ${month} (${rows.length} rows) : Total = £${total.toFixed(2)}`
       : `No transactions found for ${sub1} in ${month}.`;
 });
+
+// Precomputed rollups: [path, parent, label, out pence, in pence, count]
+function drawSunburst() {
+    const month = document.getElementById('sunburst-month').value;
+    const column = document.getElementById('sunburst-flow').value === 'in' ? 4 : 3;
+    const nodes = (sunburstData[month] || []).filter(node => node[column] > 0);
+    Plotly.react('sunburst_plot', [{
+        type: 'sunburst',
+        ids: nodes.map(node => node[0]),
+        parents: nodes.map(node => node[1]),
+        labels: nodes.map(node => node[2]),
+        values: nodes.map(node => node[column] / 100),
+        customdata: nodes.map(node => node[5]),
+        branchvalues: 'total',
+        hovertemplate: '<b>%{id}</b><br>£%{value:,.2f} (%{percentRoot:.1%})<br>%{customdata} transactions<extra></extra>',
+    }], {margin: {l: 10, r: 10, t: 10, b: 10}, height: 600});
+}
+
+document.getElementById('sunburst-month').addEventListener('change', drawSunburst);
+document.getElementById('sunburst-flow').addEventListener('change', drawSunburst);
+drawSunburst();
+
+// Cube comparisons: [category, money out, compared with, change, % change]
+function drawComparison() {
+    const month = document.getElementById('compare-month').value;
+    const view = document.getElementById('compare-view').value;
+    const rows = (comparisons[month] || {})[view] || [];
+    const tbody = document.querySelector('#compare-table tbody');
+    tbody.innerHTML = '';
+    rows.forEach(([label, now, before, change, pct]) => {
+        const tr = document.createElement('tr');
+        const cells = [label, `£${now.toFixed(2)}`, `£${before.toFixed(2)}`,
+                       `${change >= 0 ? '+' : '-'}£${Math.abs(change).toFixed(2)}`,
+                       pct === null ? 'new' : `${pct >= 0 ? '+' : ''}${pct.toFixed(1)}%`];
+        cells.forEach((value, idx) => {
+            const td = document.createElement('td');
+            td.textContent = value;
+            if (idx) td.className = 'num';
+            tr.appendChild(td);
+        });
+        tbody.appendChild(tr);
+    });
+}
+
+document.getElementById('compare-month').addEventListener('change', drawComparison);
+document.getElementById('compare-view').addEventListener('change', drawComparison);
+drawComparison();
+
+// Served by serve.py: ask its full-text index. Opened as a file: filter the
+// rows embedded in this page instead.
+const SEARCH_LIMIT = 200;
+let searchTimer = null;
+
+function localSearch(text) {
+    const words = text.toLowerCase().split(/\s+/).filter(w => w);
+    const found = [];
+    Object.values(detailMap).forEach(bySub1 => Object.values(bySub1).forEach(rows => rows.forEach(row => {
+        const desc = String(row.description).toLowerCase();
+        if (words.every(w => desc.includes(w))) found.push(row);
+    })));
+    found.sort((a, b) => String(b.date).localeCompare(String(a.date)));
+    return found.slice(0, SEARCH_LIMIT);
+}
+
+async function runSearch(text) {
+    const status = document.getElementById('search-status');
+    let rows = [];
+    if (text.trim()) {
+        if (location.protocol.startsWith('http')) {
+            const response = await fetch(`/search?limit=${SEARCH_LIMIT}&q=${encodeURIComponent(text)}`);
+            rows = (await response.json()).map(r => ({
+                date: r.date, main_category: r.main_category || 'Uncategorised', sub1: r.sub1 || '',
+                description: r.description, amount: (r.paid_in || 0) - (r.paid_out || 0),
+            }));
+        } else {
+            rows = localSearch(text);
+        }
+    }
+    const tbody = document.querySelector('#search-table tbody');
+    tbody.innerHTML = '';
+    rows.forEach(row => {
+        const tr = document.createElement('tr');
+        [row.date, row.main_category, row.sub1, row.description, `£${row.amount.toFixed(2)}`].forEach(value => {
+            const td = document.createElement('td');
+            td.textContent = value;
+            tr.appendChild(td);
+        });
+        tbody.appendChild(tr);
+    });
+    status.textContent = text.trim() ? `${rows.length} transaction(s) found${rows.length === SEARCH_LIMIT ? ' (first ' + SEARCH_LIMIT + ' shown)' : ''}.` : '';
+}
+
+document.getElementById('search-box').addEventListener('input', event => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => runSearch(event.target.value), 200);
+});
 </script>
 </body>
 </html>
@@ -261,20 +567,201 @@ plotElement.on('plotly_click', function(event) {
     return script
 
 
+def site_pages(months):
+    """{page path: (kind, title, months it shows)} for the static site: an
+    index, a page per year and a page per month."""
+    pages = {'index.html': ('index', 'Bank Statement Dashboard', list(months))}
+    years = OrderedDict()
+    for month in months:
+        years.setdefault(month[:4], []).append(month)
+    for year, year_months in years.items():
+        pages[f'{year}/index.html'] = ('year', year, year_months)
+        for month in year_months:
+            pages[f'{year}/{month}.html'] = ('month', format_month_label(month), [month])
+    return pages
+
+
+def make_index_html(months, totals, fingerprint):
+    """The site's front page: a table of months, grouped by year, linking to their pages."""
+    rows = []
+    for month in months:
+        year = month[:4]
+        if month == months[0] or year != rows[-1][0]:
+            rows.append((year, f'<tr><th colspan="5"><a href="{year}/index.html">{year}</a></th></tr>'))
+        out_pence, in_pence, count = totals.get(month, (0, 0, 0))
+        rows.append((year, f'<tr><td><a href="{year}/{month}.html">{format_month_label(month)}</a></td>'
+                           f'<td class="num">{in_pence / 100:,.2f}</td><td class="num">{out_pence / 100:,.2f}</td>'
+                           f'<td class="num">{(in_pence - out_pence) / 100:,.2f}</td><td class="num">{count}</td></tr>'))
+    return """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8" />
+<meta name="report-fingerprint" content=\"""" + fingerprint + """\" />
+<title>Bank Statement Dashboard</title>
+<style>
+ body { font-family: Arial, sans-serif; margin: 20px; }
+ table { border-collapse: collapse; margin-top: 8px; }
+ th, td { border: 1px solid #ccc; padding: 8px; text-align: left; }
+ th { background: #f2f2f2; }
+ td.num { text-align: right; }
+</style>
+</head>
+<body>
+<h1>Bank Statement Dashboard</h1>
+<table>
+  <thead>
+    <tr><th>Month</th><th>Money in</th><th>Money out</th><th>Net</th><th>Transactions</th></tr>
+  </thead>
+  <tbody>
+""" + '\n'.join(row for _, row in rows) + """
+  </tbody>
+</table>
+</body>
+</html>
+"""
+
+
+def render_site_page(kind, title, months, rollup_rows, detail_map, fingerprint):
+    """HTML for one year or month page, and the categories it shows."""
+    wanted = set(months)
+    rows = [r for r in rollup_rows if r[0] in wanted]
+    months, main_categories, all_sub1, data = build_aggregates(rows)
+    fig, trace_info = build_figure(months, data, all_sub1)
+    if kind == 'year':
+        nav = ' · '.join(['<a href="../index.html">All years</a>'] +
+                         [f'<a href="{m}.html">{format_month_label(m)}</a>' for m in months])
+    else:
+        nav = f'<a href="../index.html">All years</a> · <a href="index.html">{months[0][:4]}</a>'
+    html = make_html(fig, trace_info, main_categories, {m: detail_map.get(m, {}) for m in months},
+                     build_sunburst_data(rows), months, None, fingerprint, title, f'<p>{nav}</p>',
+                     f'../{ASSETS_DIR}/{PLOTLY_ASSET}')
+    return html, sorted(f'{main} / {sub1}' for main, sub1 in data)
+
+
+def build_site(db_file, out_dir, force=False):
+    """Write the multi-page report into out_dir, re-rendering only pages whose months changed.
+
+    out_dir/manifest.json records each page's months, categories and
+    fingerprint (see page_fingerprint()); a page is rebuilt when its
+    fingerprint differs or its file is missing, and pages for months no
+    longer in the database are removed. Year and month pages leave out the
+    comparisons panel, which would tie each page to the two years before
+    it. Pages link to one shared copy of Plotly in out_dir/assets/, and
+    every page and asset also gets precompressed copies for serve.py.
+    Returns (rebuilt page paths, removed page paths, page count).
+    """
+    write_plotly_asset(out_dir)
+    fingerprints = month_fingerprints(db_file)
+    months = sorted(fingerprints)
+    pages = site_pages(months)
+    manifest_path = os.path.join(out_dir, SITE_MANIFEST)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {'pages': {}}
+
+    dirty = {}
+    for path, (kind, title, page_months) in pages.items():
+        fingerprint = page_fingerprint(kind, page_months, fingerprints)
+        entry = manifest['pages'].get(path)
+        target = os.path.join(out_dir, path)
+        if force or not entry or entry['fingerprint'] != fingerprint or not os.path.exists(target + '.gz'):
+            dirty[path] = fingerprint
+    removed = sorted(path for path in manifest['pages'] if path not in pages)
+
+    if dirty:
+        rollup_rows = load_category_rollups(db_file)
+        # the index only needs the rollups
+        needs_details = any(pages[path][0] != 'index' for path in dirty)
+        detail_map = build_detail_map(txn_arrays.load_arrays(db_file)) if needs_details else {}
+        for path, fingerprint in dirty.items():
+            kind, title, page_months = pages[path]
+            if kind == 'index':
+                totals = defaultdict(lambda: [0, 0, 0])
+                for month, _, depth, _, _, out_pence, in_pence, count in rollup_rows:
+                    if depth == 1:
+                        total = totals[month]
+                        total[0] += out_pence
+                        total[1] += in_pence
+                        total[2] += count
+                html = make_index_html(page_months, totals, fingerprint)
+                categories = sorted({r[4] for r in rollup_rows if r[2] == 1})
+            else:
+                html, categories = render_site_page(kind, title, page_months, rollup_rows, detail_map, fingerprint)
+            target = os.path.join(out_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            write_output(target, html, compress=True)
+            manifest['pages'][path] = {'kind': kind, 'months': page_months, 'categories': categories,
+                                       'fingerprint': fingerprint}
+
+    for path in removed:
+        remove_output(os.path.join(out_dir, path))
+        del manifest['pages'][path]
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest['template_version'] = TEMPLATE_VERSION
+    manifest_json = json.dumps(manifest, indent=1, sort_keys=True)
+    write_output(manifest_path + '.tmp', manifest_json)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    precompress(manifest_path, manifest_json.encode('utf-8'))
+    return sorted(dirty), removed, len(pages)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Build the interactive dashboard from the database.")
+    parser.add_argument('--force', action='store_true', help="Rebuild even if the database has not changed")
+    parser.add_argument('--site', metavar='DIR',
+                        help="Write a multi-page report (index, per-year and per-month pages) into DIR instead, "
+                             "rebuilding only the pages whose months changed")
+    parser.add_argument('--shared-assets', action='store_true',
+                        help=f"Link {OUTPUT_FILE} to {ASSETS_DIR}/{PLOTLY_ASSET} instead of embedding Plotly, "
+                             "and write gzip/brotli copies for serve.py (--site always does)")
+    args = parser.parse_args()
+
     if not os.path.exists(DB_FILE):
         raise FileNotFoundError(f'Missing database: {DB_FILE}')
-
-    rows = load_transactions(DB_FILE)
-    months, main_categories, all_sub1, data, detail_map = build_aggregates(rows)
+    with sqlite3.connect(DB_FILE) as conn:
+        schema.require_current(conn, DB_FILE)
+        schema.require_derived(conn, DB_FILE)
+
+    if args.site:
+        rebuilt, removed, total = build_site(DB_FILE, args.site, args.force)
+        if not rebuilt and not removed:
+            print(f'Cache hit: all {total} pages in {args.site}/ are up to date, nothing to build.')
+            return
+        print(f'Rebuilt {len(rebuilt)} of {total} pages in {args.site}/' +
+              (f', removed {len(removed)}' if removed else '') + ':')
+        for path in rebuilt:
+            print(f'  {path}')
+        print(f'Open {os.path.join(args.site, "index.html")} in a browser.')
+        return
+
+    plotlyjs = True
+    if args.shared_assets:
+        if write_plotly_asset(os.path.dirname(OUTPUT_FILE) or '.'):
+            print(f'Wrote {ASSETS_DIR}/{PLOTLY_ASSET} (shared by every report)')
+        plotlyjs = f'{ASSETS_DIR}/{PLOTLY_ASSET}'
+
+    fingerprint = db_fingerprint(DB_FILE, 'dashboard-shared' if args.shared_assets else 'dashboard')
+    up_to_date = built_fingerprint(OUTPUT_FILE) == fingerprint and (
+        not args.shared_assets or os.path.exists(OUTPUT_FILE + '.gz'))
+    if not args.force and up_to_date:
+        print(f'Cache hit: {OUTPUT_FILE} is up to date (fingerprint {fingerprint[:12]}), nothing to build.')
+        return
+    print(f'Cache miss: building {OUTPUT_FILE} (fingerprint {fingerprint[:12]})')
+
+    rollup_rows = load_category_rollups(DB_FILE)
+    months, main_categories, all_sub1, data = build_aggregates(rollup_rows)
     if not months:
         raise SystemExit('No transaction months found in database.')
+    detail_map = build_detail_map(txn_arrays.load_arrays(DB_FILE))
 
     fig, trace_info = build_figure(months, data, all_sub1)
-    html = make_html(fig, trace_info, main_categories, detail_map)
+    html = make_html(fig, trace_info, main_categories, detail_map, build_sunburst_data(rollup_rows), months,
+                     load_comparisons(DB_FILE, months), fingerprint, plotlyjs=plotlyjs)
 
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write(html)
+    write_output(OUTPUT_FILE, html, compress=args.shared_assets)
 
     print(f'Wrote interactive dashboard to {OUTPUT_FILE}')
     print('Open this file in a browser to view the monthly stacked bar chart and details table.')
@@ -0,0 +1,155 @@
+import sqlite3
+import os
+import shutil
+import argparse
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+import queries
+import schema
+
+DB_FILE = 'load_statement.db'
+STORE_DIR = 'transactions_store'
+FETCH_SIZE = 50000
+COMPRESSION = 'zstd'
+
+# repeated strings are stored once per file and referenced by small integers
+DICTIONARY_COLUMNS = ['account', 'transaction_type', 'main_category', 'sub1', 'sub2', 'sub3']
+_DICT = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('month', pa.string()),
+    ('date', pa.date32()),
+    ('account', _DICT),
+    ('transaction_type', _DICT),
+    ('description', pa.string()),
+    ('paid_in', pa.float64()),
+    ('paid_out', pa.float64()),
+    ('amount', pa.float64()),
+    ('balance', pa.float64()),
+    ('rule_id', pa.int32()),
+    ('main_category', _DICT),
+    ('sub1', _DICT),
+    ('sub2', _DICT),
+    ('sub3', _DICT),
+])
+PARTITIONING = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+
+
+def _batches(conn, skipped, fetch_size=FETCH_SIZE):
+    # rows whose date is not YYYY-MM-DD are left out and added to skipped as
+    # (id, date), rather than failing the whole export part way through
+    cursor = conn.execute(queries.EXPORT_ROWS)
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        arrays = []
+        for field, values in zip(SCHEMA, columns):
+            if field.name == 'date':
+                dates = pc.strptime(pa.array(values, pa.string()), format='%Y-%m-%d', unit='s', error_is_null=True)
+                arrays.append(dates.cast(pa.date32()))
+            else:
+                arrays.append(pa.array(values, field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+        valid = batch.column('date').is_valid()
+        if valid.false_count:
+            skipped.extend((row[0], row[2]) for row, ok in zip(rows, valid.to_pylist()) if not ok)
+            batch = batch.filter(valid)
+        yield batch
+
+
+def export_store(db_file=DB_FILE, out_dir=STORE_DIR):
+    """Write transactions with their categories as a month-partitioned Parquet dataset.
+
+    Rows are streamed from SQLite in batches of FETCH_SIZE, written under
+    out_dir/month=YYYY-MM/ with zstd compression and dictionary-encoded
+    category columns. The dataset is built next to out_dir and swapped in at
+    the end, so readers never see a half-written export. Returns the row
+    count and the (id, date) of rows left out because their date is not
+    YYYY-MM-DD.
+    """
+    skipped = []
+    # write_dataset pulls the batches from one of its own threads
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    try:
+        reader = pa.RecordBatchReader.from_batches(SCHEMA, _batches(conn, skipped))
+        building = out_dir + '.building'
+        shutil.rmtree(building, ignore_errors=True)
+        file_format = ds.ParquetFileFormat()
+        ds.write_dataset(
+            reader, building, format=file_format, partitioning=PARTITIONING,
+            file_options=file_format.make_write_options(compression=COMPRESSION, use_dictionary=DICTIONARY_COLUMNS),
+            basename_template='part-{i}.parquet', existing_data_behavior='error',
+        )
+    finally:
+        conn.close()
+
+    # directories cannot be replaced in one step; move the old one aside first
+    previous = out_dir + '.previous'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, previous)
+    os.replace(building, out_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    return read_store(out_dir, columns=['id']).num_rows, skipped
+
+
+def open_store(path=STORE_DIR):
+    return ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+
+def read_store(path=STORE_DIR, columns=None, months=None, **equals):
+    """Read the exported transactions as a pyarrow Table.
+
+    Only the requested columns are decoded, and months ('YYYY-MM' values)
+    prune whole partitions before any file is opened; other keyword
+    arguments filter on column equality, e.g. main_category='WANT'.
+    """
+    expression = None
+    if months:
+        expression = ds.field('month').isin(list(months))
+    for name, value in equals.items():
+        condition = ds.field(name) == value
+        expression = condition if expression is None else expression & condition
+    return open_store(path).to_table(columns=columns, filter=expression)
+
+
+def read_frame(path=STORE_DIR, columns=None, months=None, **equals):
+    """As read_store(), as a pandas DataFrame (dictionary columns become categoricals)."""
+    return read_store(path, columns, months, **equals).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export transactions to a columnar Parquet store, or read it back.")
+    parser.add_argument('--out', default=STORE_DIR, help="Folder for the Parquet dataset")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    parser.add_argument('--read', action='store_true', help="Summarise the existing store instead of exporting")
+    parser.add_argument('--month', action='append', help="With --read, only these months (YYYY-MM, repeatable)")
+    args = parser.parse_args()
+
+    if args.read:
+        table = read_store(args.out, columns=['month', 'main_category', 'amount'], months=args.month)
+        summary = table.group_by(['month', 'main_category']).aggregate([('amount', 'sum'), ('amount', 'count')])
+        for row in sorted(summary.to_pylist(), key=lambda r: (r['month'], r['main_category'])):
+            print(f"{row['month']}  {row['main_category']:<20} {row['amount_sum']:>12,.2f}  ({row['amount_count']})")
+        print(f'{table.num_rows} transactions read from {args.out}')
+    else:
+        with sqlite3.connect(args.db) as conn:
+            schema.require_current(conn, args.db)
+        count, skipped = export_store(args.db, args.out)
+        print(f'✅ Exported {count} transactions to {args.out}/ (Parquet, partitioned by month)')
+        if skipped:
+            print(f'⚠️ Left out {len(skipped)} transaction(s) whose date is not YYYY-MM-DD:')
+            for txn_id, date in skipped[:10]:
+                print(f'  id {txn_id}: {date!r}')
+            if len(skipped) > 10:
+                print(f'  ... and {len(skipped) - 10} more')
+
+
+if __name__ == '__main__':
+    main()
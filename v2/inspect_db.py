@@ -1,16 +1,15 @@
 import sqlite3
 import sys
+import os
+import time
+import argparse
+
+import queries
 
 DB = 'load_statement.db'
 
-def main():
-    try:
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-    except Exception as e:
-        print('ERROR: cannot open database', DB, e)
-        sys.exit(1)
 
+def summary(cur):
     try:
         tables = [r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
     except Exception as e:
@@ -35,6 +34,129 @@ def main():
     except Exception as e:
         print('No transactions or error querying dates:', e)
 
+
+def file_stats(conn):
+    """Page size, page count, free pages and bytes on disk."""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    path = conn.execute('PRAGMA database_list').fetchone()[2]
+    size = os.path.getsize(path) if path and os.path.exists(path) else pages * page_size
+    return {'page_size': page_size, 'pages': pages, 'free_pages': free, 'bytes': size}
+
+
+def object_sizes(conn):
+    """{name: (pages, bytes)} per table and index, or None without the dbstat table."""
+    try:
+        rows = conn.execute('SELECT name, count(*), sum(pgsize) FROM dbstat GROUP BY name').fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return {name: (pages, size) for name, pages, size in rows}
+
+
+def print_storage(conn):
+    stats = file_stats(conn)
+    print(f"File: {stats['bytes']:,} bytes, {stats['pages']:,} pages of {stats['page_size']} bytes, "
+          f"{stats['free_pages']:,} free ({stats['free_pages'] / max(stats['pages'], 1):.1%})")
+    sizes = object_sizes(conn)
+    if sizes is None:
+        print('⚠️ This SQLite has no dbstat table, so per-table sizes are not available.')
+        sizes = {}
+
+    print('Tables:')
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"):
+        rows = conn.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+        pages, size = sizes.get(name, ('?', 0))
+        print(f'  {name:<32} {rows:>10,} rows  {pages:>6} pages  {size:>12,} bytes')
+
+    print('Indexes:')
+    for name, table, sql in conn.execute(
+            "SELECT name, tbl_name, sql FROM sqlite_master WHERE type='index' ORDER BY tbl_name, name"):
+        pages, size = sizes.get(name, ('?', 0))
+        kind = 'automatic' if sql is None else 'partial' if ' WHERE ' in sql.upper() else ''
+        print(f'  {name:<32} on {table:<18} {pages:>6} pages  {size:>12,} bytes  {kind}')
+
+
+def print_plans(conn):
+    """EXPLAIN QUERY PLAN for every pipeline query; returns how many were flagged."""
+    flagged = 0
+    for query in queries.pipeline_queries():
+        try:
+            result = queries.check_query(conn, query)
+        except sqlite3.Error as e:
+            print(f"⚠️ {query['name']} ({query['source']}): cannot plan: {e}")
+            flagged += 1
+            continue
+        problems = [f'full scan of {s}' for s in result['unexpected_scans']]
+        problems += [f'does not use {u}' for u in result['missing']]
+        print(f"{'⚠️' if problems else '✅'} {query['name']} ({query['source']})")
+        for line in result['plan']:
+            print(f'      {line}')
+        for problem in problems:
+            print(f'    ⛔ {problem}')
+        flagged += bool(problems)
+    return flagged
+
+
+def print_statistics(conn):
+    """What ANALYZE recorded in sqlite_stat1: rows per table and rows per index key."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if not exists:
+        print('No ANALYZE statistics yet (run with --analyze).')
+        return
+    print('ANALYZE statistics (table, index: rows, then average rows per key prefix):')
+    for table, index, stat in conn.execute('SELECT tbl, idx, stat FROM sqlite_stat1 ORDER BY tbl, idx'):
+        print(f"  {table:<24} {index or '(table)':<32} {stat}")
+
+
+def maintain(conn, label, statement):
+    """Run a maintenance statement and print the file before and after."""
+    before = file_stats(conn)
+    start = time.perf_counter()
+    conn.execute(statement)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    after = file_stats(conn)
+    print(f"{label} took {elapsed:.3f}s: {before['bytes']:,} -> {after['bytes']:,} bytes, "
+          f"{before['pages']:,} -> {after['pages']:,} pages, "
+          f"{before['free_pages']:,} -> {after['free_pages']:,} free")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the database, or diagnose its size, indexes and query plans.")
+    parser.add_argument('--db', default=DB, help="Path to the SQLite database")
+    parser.add_argument('--diagnose', action='store_true',
+                        help="Report page counts, table and index sizes, the pipeline's query plans and ANALYZE statistics")
+    parser.add_argument('--analyze', action='store_true', help="Gather fresh planner statistics (ANALYZE) first")
+    parser.add_argument('--optimize', action='store_true', help="Run PRAGMA optimize")
+    parser.add_argument('--vacuum', action='store_true', help="Rebuild the file with VACUUM to drop free pages")
+    args = parser.parse_args()
+
+    try:
+        conn = sqlite3.connect(args.db)
+        cur = conn.cursor()
+    except Exception as e:
+        print('ERROR: cannot open database', args.db, e)
+        sys.exit(1)
+
+    if args.analyze:
+        maintain(conn, 'ANALYZE', 'ANALYZE')
+    if args.optimize:
+        maintain(conn, 'PRAGMA optimize', 'PRAGMA optimize')
+    if args.vacuum:
+        maintain(conn, 'VACUUM', 'VACUUM')
+
+    if args.diagnose:
+        print_storage(conn)
+        print()
+        flagged = print_plans(conn)
+        print()
+        print_statistics(conn)
+        if flagged:
+            print(f'\n⚠️  {flagged} pipeline query plan(s) need attention.')
+    elif not (args.analyze or args.optimize or args.vacuum):
+        summary(cur)
+
     conn.close()
 
 if __name__ == '__main__':
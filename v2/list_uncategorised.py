@@ -1,20 +1,36 @@
 import sqlite3
+import re
+import zlib
+import argparse
+from collections import defaultdict
+
+import queries
+import schema
 
 DB_FILE = 'load_statement.db'
 
+# MinHash / LSH settings: BANDS x ROWS signatures, with pairs checked
+# against the real shingle similarity before they are merged
+NUM_HASHES = 32
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+SIMILARITY = 0.5
+SHINGLE = 3
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+
+# punctuation (so 'UK*AB12CD' splits), then any word with a digit in it:
+# card refs, dates, store numbers
+_PUNCT = re.compile(r'[^\w\s&]|_')
+_HAS_DIGIT = re.compile(r'\S*\d\S*')
+_SPACES = re.compile(r'\s+')
+
+
 def list_uncategorised_transactions():
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
 
-    query = '''
-    SELECT DISTINCT t.transaction_type, t.description
-    FROM transactions t
-    LEFT JOIN categorised c ON t.id = c.transaction_id
-    WHERE c.main_category = 'Uncategorised' OR c.main_category IS NULL
-    ORDER BY t.transaction_type, t.description
-    '''
-
-    cursor.execute(query)
+    cursor.execute(queries.UNCATEGORISED_PAIRS)
     rows = cursor.fetchall()
 
     if not rows:
@@ -26,6 +42,138 @@ def list_uncategorised_transactions():
 
     conn.close()
 
-if __name__ == "__main__":
-    list_uncategorised_transactions()
 
+def normalise_payee(desc):
+    """Strip the parts of a description that change between payments to one payee."""
+    text = (desc or '').upper()
+    text = _PUNCT.sub(' ', text)
+    text = _HAS_DIGIT.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def shingles(text):
+    text = f' {text} '
+    return {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+
+
+# fixed seeds so clusters come out the same on every run
+_COEFFS = [((i * 0x9E3779B1 + 0x7F4A7C15) % _PRIME | 1, (i * 0x85EBCA77 + 0xC2B2AE3D) % _PRIME)
+           for i in range(1, NUM_HASHES + 1)]
+
+
+def minhash(shingle_set):
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingle_set]
+    return [min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in _COEFFS]
+
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def cluster_payees(payees):
+    """Group similar normalised payee strings; returns a list of lists of payees."""
+    payees = sorted(payees)
+    shingle_sets = [shingles(p) for p in payees]
+    parent = list(range(len(payees)))
+
+    buckets = defaultdict(list)
+    for i, shingle_set in enumerate(shingle_sets):
+        signature = minhash(shingle_set)
+        for band in range(BANDS):
+            buckets[(band, tuple(signature[band * ROWS:(band + 1) * ROWS]))].append(i)
+
+    for members in buckets.values():
+        for j, other in enumerate(members[1:], 1):
+            b = shingle_sets[other]
+            for first in members[:j]:
+                a = shingle_sets[first]
+                if len(a & b) / len(a | b) >= SIMILARITY:
+                    parent[_find(parent, other)] = _find(parent, first)
+                    break
+
+    groups = defaultdict(list)
+    for i, payee in enumerate(payees):
+        groups[_find(parent, i)].append(payee)
+    return list(groups.values())
+
+
+def fetch_uncategorised(conn):
+    return conn.execute(queries.UNCATEGORISED_ROWS).fetchall()
+
+
+def cluster_uncategorised(conn):
+    """Cluster uncategorised transactions by similar payee, biggest spend first.
+
+    Each cluster is a dict with 'label', 'count', 'spent' (paid out minus
+    paid in), 'first_date', 'last_date', 'payees' (normalised strings),
+    'variants' ({(type, description): count}) and 'rows'.
+    """
+    rows = fetch_uncategorised(conn)
+    by_payee = defaultdict(list)
+    for row in rows:
+        by_payee[normalise_payee(row[3])].append(row)
+
+    clusters = []
+    for payees in cluster_payees(by_payee):
+        members = [row for p in payees for row in by_payee[p]]
+        variants = defaultdict(int)
+        for _, _, txn_type, desc, _, _ in members:
+            variants[(txn_type or '', desc or '')] += 1
+        dates = [r[1] for r in members if r[1]]
+        label = max(payees, key=lambda p: (len(by_payee[p]), p))
+        clusters.append({
+            'label': label or '(blank description)',
+            'count': len(members),
+            'spent': sum((r[5] or 0.0) - (r[4] or 0.0) for r in members),
+            'first_date': min(dates) if dates else '',
+            'last_date': max(dates) if dates else '',
+            'payees': payees,
+            'variants': dict(variants),
+            'rows': members,
+        })
+    clusters.sort(key=lambda c: (-abs(c['spent']), -c['count'], c['label']))
+    return clusters
+
+
+def print_clusters(top=None, variants_shown=3):
+    conn = sqlite3.connect(DB_FILE)
+    clusters = cluster_uncategorised(conn)
+    conn.close()
+
+    if not clusters:
+        print("All transactions are categorised!")
+        return
+
+    total = sum(c['count'] for c in clusters)
+    at_stake = sum(abs(c['spent']) for c in clusters)
+    print(f"{total} uncategorised transactions in {len(clusters)} payee clusters (£{at_stake:,.2f} at stake), biggest first:")
+    for n, c in enumerate(clusters[:top] if top else clusters, 1):
+        print(f"{n:>3}. {c['label']}: {c['count']} txns, £{c['spent']:,.2f} net spend, "
+              f"{c['first_date']} to {c['last_date']}, {len(c['variants'])} variant(s)")
+        common = sorted(c['variants'].items(), key=lambda kv: (-kv[1], kv[0]))
+        for (txn_type, desc), count in common[:variants_shown]:
+            print(f"       - {txn_type} | {desc} ({count})")
+        if len(common) > variants_shown:
+            print(f"       ... and {len(common) - variants_shown} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report uncategorised transactions.")
+    parser.add_argument('--flat', action='store_true', help="Plain list of unique type | description pairs")
+    parser.add_argument('--top', type=int, default=None, help="Only show the N clusters with the most money at stake")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_FILE)
+    schema.require_current(conn, DB_FILE)
+    conn.close()
+    if args.flat:
+        list_uncategorised_transactions()
+    else:
+        print_clusters(args.top)
+
+
+if __name__ == "__main__":
+    main()
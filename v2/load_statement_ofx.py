@@ -4,8 +4,60 @@ import sys
 import os
 from pathlib import Path
 
+import cube
+import db_build
+import queries
+import rollups
+import schema
+import search
+from rule_cache import RULE_COLUMNS
+
+
+# Show at most this many differing days when reconciling against the last load
+MAX_MISMATCHES_SHOWN = 10
+
+
+def parse_ofx_date(date_raw):
+    if len(date_raw) >= 8:
+        # YYYYMMDD...
+        return f"{date_raw[0:4]}-{date_raw[4:6]}-{date_raw[6:8]}"
+    return date_raw
+
+
+def statement_blocks(ofx_text):
+    """Split an OFX file into (account id, statement text) pairs, one per account."""
+    blocks = re.findall(r'<(?:CC)?STMTRS>(.*?)</(?:CC)?STMTRS>', ofx_text, re.S | re.I)
+    if not blocks:
+        blocks = [ofx_text]
+    statements = []
+    for b in blocks:
+        m = re.search(r'<ACCTID>([^<\r\n]+)', b, re.I)
+        statements.append((m.group(1).strip() if m else '', b))
+    return statements
+
+
+def parse_ofx_ledger_balances(ofx_text):
+    """Return {account id: (closing balance, as-of date)} from each <LEDGERBAL>."""
+    balances = {}
+    for account, block in statement_blocks(ofx_text):
+        m = re.search(r'<LEDGERBAL>(.*?)(?:</LEDGERBAL>|<AVAILBAL>|$)', block, re.S | re.I)
+        if not m:
+            continue
+        amount = re.search(r'<BALAMT>([^<\r\n]+)', m.group(1), re.I)
+        as_of = re.search(r'<DTASOF>([^<\r\n]+)', m.group(1), re.I)
+        if amount and as_of:
+            balances[account] = (float(amount.group(1).strip().replace(',', '')), parse_ofx_date(as_of.group(1).strip()))
+    return balances
+
 
 def parse_ofx_transactions(ofx_text):
+    txns = []
+    for account, statement in statement_blocks(ofx_text):
+        txns += parse_statement_transactions(statement, account)
+    return txns
+
+
+def parse_statement_transactions(ofx_text, account=''):
     # Find all <STMTTRN>...</STMTTRN> blocks
     blocks = re.findall(r'<STMTTRN>(.*?)</STMTTRN>', ofx_text, re.S | re.I)
     txns = []
@@ -13,15 +65,7 @@ def parse_ofx_transactions(ofx_text):
         # get date
         m = re.search(r'<DTPOSTED>([^<\r\n]+)', b, re.I)
         date_raw = m.group(1).strip() if m else ''
-        date = ''
-        if len(date_raw) >= 8:
-            # YYYYMMDD...
-            try:
-                date = f"{date_raw[0:4]}-{date_raw[4:6]}-{date_raw[6:8]}"
-            except Exception:
-                date = date_raw
-        else:
-            date = date_raw
+        date = parse_ofx_date(date_raw)
 
         # transaction amount
         m = re.search(r'<TRNAMT>([^<\r\n]+)', b, re.I)
@@ -53,17 +97,158 @@ def parse_ofx_transactions(ofx_text):
             paid_out = 0.0
 
         txns.append({
+            'account': account,
             'date': date,
             'transaction_type': trn_type,
             'description': desc,
             'paid_out': paid_out,
             'paid_in': paid_in,
+            # filled in by compute_balances() once the whole statement is loaded
             'balance': 0.0,
         })
 
     return txns
 
 
+def compute_balances(cursor):
+    """Fill transactions.balance per account, anchored on the statement's LEDGERBAL.
+
+    The running total comes from one window-function pass, in pence to avoid
+    float drift; the opening balance makes the total at the LEDGERBAL date
+    equal the bank's figure. End-of-day balances go to daily_balances so a
+    balance as of any date is a single primary-key lookup.
+    """
+    cursor.execute(f'''
+        UPDATE transactions
+        SET balance = b.balance
+        FROM ({queries.RUNNING_BALANCES}) b
+        WHERE transactions.id = b.id
+    ''')
+    cursor.execute('DELETE FROM daily_balances')
+    cursor.execute(f'INSERT INTO daily_balances (account, date, balance) {queries.END_OF_DAY_BALANCES}')
+
+
+def balance_as_of(conn, account, date):
+    """End-of-day balance of account on date (or the last day before it with activity)."""
+    row = conn.execute(queries.BALANCE_AS_OF, (account, date)).fetchone()
+    return row[0] if row else None
+
+
+def opening_balance(conn, account):
+    """(date, balance) before the account's first transaction in this load, or None."""
+    return conn.execute('''
+        SELECT date, balance - (COALESCE(paid_in, 0) - COALESCE(paid_out, 0))
+        FROM transactions WHERE account = ?
+        ORDER BY date, id
+        LIMIT 1
+    ''', (account,)).fetchone()
+
+
+def carry_over_rules(conn, previous_db):
+    """Copy the category rules, ids included, from the previous load.
+
+    Rule ids then survive reloading a statement, so `search.py --rule N`
+    keeps meaning the same rule. Returns how many rules were copied (none
+    from a database at an older schema version; categorise_md.py fills
+    those in afresh).
+    """
+    if not os.path.exists(previous_db):
+        return 0
+    columns = ', '.join(['id'] + RULE_COLUMNS + ['position'])
+    previous = sqlite3.connect(previous_db)
+    try:
+        if schema.schema_version(previous) < schema.SCHEMA_VERSION:
+            return 0
+        rules = previous.execute(f'SELECT {columns} FROM categories').fetchall()
+        sequence = previous.execute("SELECT seq FROM sqlite_sequence WHERE name = 'categories'").fetchone()
+        rules_hash = previous.execute("SELECT value FROM meta WHERE key = 'rules_hash'").fetchone()
+    finally:
+        previous.close()
+
+    if not rules:
+        return 0
+    conn.executemany(f'INSERT INTO categories ({columns}) VALUES ({", ".join("?" * len(rules[0]))})', rules)
+    if sequence:
+        # ids of rules deleted since stay retired
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'categories'", sequence)
+    if rules_hash:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rules_hash', ?)", rules_hash)
+    return len(rules)
+
+
+def reconcile(cursor, ledger_balances, previous_db=None):
+    """Report how the computed balances agree with the previous load.
+
+    Balances are anchored on each statement's LEDGERBAL, so they agree with
+    it by construction; what can be checked is that this statement joins up
+    with the previous load: its opening balance against the previous load's
+    balance at the end of the day before, and end-of-day balances on any
+    days both loads cover. Returns the mismatch count.
+    """
+    mismatches = 0
+    accounts = [r[0] for r in cursor.execute('SELECT DISTINCT account FROM transactions ORDER BY account')]
+    conn = cursor.connection
+
+    previous = None
+    if previous_db and os.path.exists(previous_db):
+        previous = sqlite3.connect(previous_db)
+        has_balances = previous.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_balances'").fetchone()
+        if not has_balances:
+            previous.close()
+            previous = None
+
+    for account in accounts:
+        label = account or '(no ACCTID)'
+        if account not in ledger_balances:
+            print(f"⚠️  {label}: no <LEDGERBAL> in the statement; balances are relative to a zero opening balance")
+            continue
+        ledger, as_of = ledger_balances[account]
+        if balance_as_of(conn, account, as_of) is None:
+            # nothing to anchor on that day, so LEDGERBAL is the balance before the first transaction
+            print(f"{label}: no transactions on or before the LEDGERBAL date {as_of}; "
+                  f"opening balance taken as LEDGERBAL {ledger:.2f}")
+        else:
+            print(f"{label}: balances anchored on LEDGERBAL {ledger:.2f} on {as_of}")
+        later = cursor.execute('''
+            SELECT COUNT(*), MAX(date) FROM transactions WHERE account = ? AND date > ?
+        ''', (account, as_of)).fetchone()
+        if later[0]:
+            print(f"    {later[0]} transaction(s) dated after {as_of}; balance on {later[1]} is {balance_as_of(conn, account, later[1]):.2f}")
+
+        if previous is None:
+            continue
+        # the previous load's closing balance, from its own LEDGERBAL, should
+        # carry over into this statement's opening balance
+        first_date, opening = opening_balance(conn, account)
+        before = previous.execute(queries.BALANCE_BEFORE, (account, first_date)).fetchone()
+        if before is not None:
+            if round(before[1] - opening, 2) != 0:
+                mismatches += 1
+                print(f"⚠️  {label}: opening balance {opening:.2f} on {first_date} does not follow on from the "
+                      f"previous load's {before[1]:.2f} on {before[0]} (transactions missing in between?)")
+            else:
+                print(f"✅ {label}: opening balance {opening:.2f} follows on from the previous load's {before[0]}")
+        # days both loads cover should have the same end-of-day balance
+        old = dict(previous.execute(
+            'SELECT date, balance FROM daily_balances WHERE account = ?', (account,)).fetchall())
+        differing = [
+            (date, old[date], balance)
+            for date, balance in cursor.execute(
+                'SELECT date, balance FROM daily_balances WHERE account = ? ORDER BY date', (account,))
+            if date in old and round(old[date] - balance, 2) != 0
+        ]
+        if differing:
+            mismatches += 1
+            print(f"⚠️  {label}: {len(differing)} day(s) differ from the previous load (missing or duplicated transactions?):")
+            for date, was, now in differing[:MAX_MISMATCHES_SHOWN]:
+                print(f"    {date}: previously {was:.2f}, now {now:.2f}")
+
+    if previous is not None:
+        previous.close()
+    return mismatches
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python load_statement_ofx.py path/to/file.ofx")
@@ -80,67 +265,30 @@ def main():
         content = f.read()
 
     transactions = parse_ofx_transactions(content)
+    ledger_balances = parse_ofx_ledger_balances(content)
 
     # === CONFIG ===
     DB_FILE = 'load_statement.db'
 
     # === SETUP DATABASE ===
-    conn = sqlite3.connect(DB_FILE)
+    # Build a fresh database off to the side and swap it in once complete, so
+    # readers never see half-populated tables and a crash leaves DB_FILE alone
+    conn = db_build.open_build_db(DB_FILE)
     cursor = conn.cursor()
 
-    # Drop tables if they exist (for clean reruns; optional)
-    cursor.executescript('''
-    DROP TABLE IF EXISTS transactions;
-    DROP TABLE IF EXISTS categories;
-    DROP TABLE IF EXISTS categorised;
-    ''')
-
-    # Create the transactions table
-    cursor.execute('''
-    CREATE TABLE transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        date TEXT,
-        transaction_type TEXT,
-        description TEXT,
-        paid_out REAL,
-        paid_in REAL,
-        balance REAL
-    )
-    ''')
-
-    # Create the categories table with regex pattern match fields
-    cursor.execute('''
-    CREATE TABLE categories (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        transaction_type_pattern TEXT,
-        description_pattern TEXT,
-        main_category TEXT,
-        sub1 TEXT,
-        sub2 TEXT,
-        sub3 TEXT,
-        notes TEXT
-    )
-    ''')
-
-    # Create the categorised table linking transaction IDs to category information
-    cursor.execute('''
-    CREATE TABLE categorised (
-        transaction_id INTEGER PRIMARY KEY,
-        main_category TEXT,
-        sub1 TEXT,
-        sub2 TEXT,
-        sub3 TEXT,
-        notes TEXT,
-        FOREIGN KEY(transaction_id) REFERENCES transactions(id)
-    )
-    ''')
+    # Every table and index, at the current schema version
+    schema.migrate(conn)
+    carried = carry_over_rules(conn, DB_FILE)
+    if carried:
+        print(f"Kept {carried} category rules (and their ids) from the previous load.")
 
     # Insert transactions
     for t in transactions:
         cursor.execute('''
-            INSERT INTO transactions (date, transaction_type, description, paid_out, paid_in, balance)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO transactions (account, date, transaction_type, description, paid_out, paid_in, balance)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
+            t['account'],
             t['date'],
             t['transaction_type'],
             t['description'],
@@ -149,44 +297,24 @@ def main():
             t['balance']
         ))
 
-    # === INSERT DEFAULT CATEGORY ===
-    cursor.execute('''
-    INSERT INTO categories (transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes)
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', ('.*', '.*', 'Uncategorised', '', '', '', ''))
+    cursor.executemany(
+        'INSERT INTO statement_balances (account, ledger_balance, ledger_date) VALUES (?, ?, ?)',
+        [(account, amount, as_of) for account, (amount, as_of) in ledger_balances.items()]
+    )
+    compute_balances(cursor)
+    search.index_transactions(conn)
+    mismatches = reconcile(cursor, ledger_balances, previous_db=DB_FILE)
+    if mismatches:
+        print(f"⚠️  {mismatches} reconciliation problem(s) found - check the statement before relying on balances.")
 
     # === CATEGORISE TRANSACTIONS ===
-    cursor.execute('SELECT id, transaction_type, description FROM transactions')
-    transactions_db = cursor.fetchall()
-
-    cursor.execute('SELECT transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes FROM categories')
-    category_rules = cursor.fetchall()
-
-    for txn_id, txn_type, desc in transactions_db:
-        matched_main_category = 'Uncategorised'
-        matched_sub1 = ''
-        matched_sub2 = ''
-        matched_sub3 = ''
-        matched_notes = ''
-        for type_pattern, desc_pattern, main_category, sub1, sub2, sub3, notes in category_rules:
-            try:
-                if re.match(type_pattern, txn_type) and re.match(desc_pattern, desc):
-                    matched_main_category = main_category
-                    matched_sub1 = sub1
-                    matched_sub2 = sub2
-                    matched_sub3 = sub3
-                    matched_notes = notes
-                    break
-            except re.error:
-                # skip invalid regex patterns
-                continue
-        cursor.execute('''
-            INSERT INTO categorised (transaction_id, main_category, sub1, sub2, sub3, notes)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (txn_id, matched_main_category, matched_sub1, matched_sub2, matched_sub3, matched_notes))
+    # Every transaction starts out Uncategorised (no rule_id) until
+    # categorise_md.py applies categories.md
+    cursor.execute('INSERT INTO categorised (transaction_id, rule_id) SELECT id, NULL FROM transactions ORDER BY id')
+    rollups.rebuild_rollups(conn)
+    cube.refresh_cube(conn)
 
-    conn.commit()
-    conn.close()
+    db_build.publish(conn, DB_FILE)
 
     print("Database created and populated successfully from OFX.")
 
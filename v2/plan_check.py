@@ -0,0 +1,151 @@
+import sqlite3
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import cube
+import queries
+import schema
+import search
+
+ROWS = 200000
+ACCOUNTS = ['12345678', '87654321', '55556666']
+PAYEES = ['TESCO STORES', 'SAINSBURYS', 'AMZN Mktp UK', 'SHELL', 'COSTA COFFEE', 'NETFLIX.COM',
+          'PRET A MANGER', 'TFL TRAVEL CH', 'BOOTS', 'CURRYS', 'DELIVEROO', 'UBER TRIP']
+CATEGORIES = [('NEED', 'FOOD'), ('WANT', 'EATING OUT'), ('NEED', 'Household'), ('NEED', 'Travel'),
+              ('WANT', 'Entertainment'), ('WANT', 'Shopping')]
+# share of transactions no rule matches
+UNCATEGORISED_SHARE = 0.3
+
+# seconds each query may take over the synthetic database (best of REPEATS)
+LATENCY_CEILINGS = {
+    'uncategorised_pairs': 0.5,
+    'uncategorised_rows': 0.5,
+    'transactions_with_categories': 2.0,
+    'categorise_transactions': 0.5,
+    'category_rules': 0.05,
+    'rule_hits': 0.05,
+    'search_text': 0.1,
+    'balance_as_of': 0.01,
+    'balance_before': 0.01,
+    'rule_months': 0.5,
+    'cube_month': 0.01,
+    'rollup_rows': 1.5,
+    'cube_cells': 1.5,
+    'cube_cells_months': 0.2,
+    'running_balances': 4.0,
+    'end_of_day_balances': 2.5,
+    'export_rows': 3.0,
+}
+REPEATS = 3
+
+
+def build_database(path, rows=ROWS, seed=1):
+    """A database at the current schema with rows synthetic transactions, categorised and indexed."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    schema.migrate(conn)
+
+    rules = []
+    for n, payee in enumerate(PAYEES):
+        main, sub1 = CATEGORIES[n % len(CATEGORIES)]
+        rules.append(('.*', f'^{payee}', main, sub1, '', '', ''))
+    conn.executemany('''
+        INSERT INTO categories (transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rules)
+    rule_ids = [r[0] for r in conn.execute('SELECT id FROM categories ORDER BY id')]
+
+    # statements load oldest first, so ids follow the dates
+    days = sorted(rng.randrange(3 * 365) for _ in range(rows))
+    transactions, categorised = [], []
+    for txn_id, day in enumerate(days, 1):
+        date = time.strftime('%Y-%m-%d', time.gmtime((19358 + day) * 86400))  # from 2023-01-01
+        n = rng.randrange(len(PAYEES))
+        paid_out = round(rng.uniform(1, 200), 2)
+        transactions.append((txn_id, rng.choice(ACCOUNTS), date, 'DEBIT',
+                             f'{PAYEES[n]} {rng.randrange(10000)}', paid_out, None, None))
+        categorised.append((txn_id, None if rng.random() < UNCATEGORISED_SHARE else rule_ids[n]))
+    conn.executemany('INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)', transactions)
+    conn.executemany('INSERT INTO categorised (transaction_id, rule_id) VALUES (?, ?)', categorised)
+    conn.executemany('INSERT INTO statement_balances (account, ledger_balance, ledger_date) VALUES (?, ?, ?)',
+                     [(account, 1000.0, '2024-06-30') for account in ACCOUNTS])
+    conn.execute('''
+        INSERT INTO daily_balances (account, date, balance)
+        SELECT account, date, -sum(paid_out) FROM transactions GROUP BY account, date
+    ''')
+    search.index_transactions(conn)
+    cube.refresh_cube(conn)
+    conn.commit()
+    return conn
+
+
+def best_time(conn, sql, params, repeats=REPEATS):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_plans(conn, scale=1.0):
+    """Plan and time every pipeline query; returns the failure messages."""
+    failures = []
+    for query in queries.pipeline_queries():
+        name = query['name']
+        result = queries.check_query(conn, query)
+        problems = [f'full scan of {s}' for s in result['unexpected_scans']]
+        problems += [f'does not use {u}' for u in result['missing']]
+        elapsed = best_time(conn, query['sql'], query['params'])
+        ceiling = LATENCY_CEILINGS.get(name)
+        if ceiling is None:
+            problems.append('no latency ceiling set in plan_check.LATENCY_CEILINGS')
+        elif elapsed > ceiling * scale:
+            problems.append(f'took {elapsed:.3f}s, ceiling {ceiling * scale:.3f}s')
+        print(f"{'⛔' if problems else '✅'} {name:<30} {elapsed:.4f}s  {' | '.join(result['plan'])}")
+        failures += [f'{name}: {p}' for p in problems]
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a large synthetic database and check every pipeline query's plan and speed.")
+    parser.add_argument('--rows', type=int, default=ROWS, help="Synthetic transactions to generate")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Multiply the latency ceilings, e.g. 2 on a slow machine")
+    parser.add_argument('--analyze', action='store_true', help="Run ANALYZE before planning, as a maintained database would")
+    parser.add_argument('--keep', metavar='FILE', help="Build the database in this new file and keep it")
+    args = parser.parse_args()
+
+    if args.keep and os.path.exists(args.keep):
+        print(f'⛔ {args.keep} already exists; --keep needs a new file, so nothing is overwritten.')
+        sys.exit(1)
+    path = args.keep or os.path.join(tempfile.mkdtemp(), 'plan_check.db')
+    start = time.perf_counter()
+    conn = build_database(path, args.rows)
+    print(f'Built {args.rows:,} synthetic transactions in {time.perf_counter() - start:.1f}s ({path})')
+    if args.analyze:
+        conn.execute('ANALYZE')
+        conn.commit()
+
+    failures = check_plans(conn, args.scale)
+    conn.close()
+    if not args.keep:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+    if failures:
+        print(f'⛔ {len(failures)} plan check(s) failed:')
+        for failure in failures:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('✅ All pipeline queries use their indexes within their latency ceilings.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import re
+
+import cube
+import rollups
+import search
+
+# The read queries the pipeline runs, kept here so the scripts that issue
+# them and the plan checks in inspect_db.py / plan_check.py share one copy.
+
+UNCATEGORISED_PAIRS = '''
+    SELECT DISTINCT t.transaction_type, t.description
+    FROM categorised c
+    JOIN transactions t ON t.id = c.transaction_id
+    WHERE c.rule_id IS NULL
+    ORDER BY t.transaction_type, t.description
+'''
+
+# every transaction has a categorised row, so starting from categorised lets
+# SQLite read only the partial index of uncategorised rows
+UNCATEGORISED_ROWS = '''
+    SELECT t.id, t.date, t.transaction_type, t.description, t.paid_in, t.paid_out
+    FROM categorised c
+    JOIN transactions t ON t.id = c.transaction_id
+    WHERE c.rule_id IS NULL
+    ORDER BY c.transaction_id
+'''
+
+DATED_TRANSACTION_COUNT = "SELECT count(*) FROM transactions WHERE COALESCE(date, '') != ''"
+
+TRANSACTIONS_WITH_CATEGORIES = '''
+    SELECT t.id, t.date, COALESCE(t.paid_in, 0), COALESCE(t.paid_out, 0), COALESCE(c.rule_id, -1),
+           COALESCE(t.account, ''), COALESCE(r.main_category, 'Uncategorised'),
+           COALESCE(r.sub1, ''), COALESCE(r.sub2, ''), COALESCE(r.sub3, ''),
+           COALESCE(t.description, '')
+    FROM transactions t
+    LEFT JOIN categorised c ON c.transaction_id = t.id
+    LEFT JOIN categories r ON r.id = c.rule_id
+    WHERE COALESCE(t.date, '') != ''
+    ORDER BY t.date, t.id
+'''
+
+CATEGORISE_TRANSACTIONS = 'SELECT id, transaction_type, description FROM transactions'
+
+CATEGORY_RULES = '''
+    SELECT id, transaction_type_pattern, description_pattern, main_category, sub1, sub2, sub3, notes
+    FROM categories
+    ORDER BY position, id
+'''
+
+# each transaction's running balance per account, in pence to avoid float
+# drift, offset so the total at the LEDGERBAL date is the bank's figure.
+# opening is MATERIALIZED so its correlated sum runs once per account; left
+# to the planner it is inlined and runs once per transaction.
+RUNNING_BALANCES = '''
+    WITH running AS (
+        SELECT id, account,
+               SUM(CAST(ROUND((paid_in - paid_out) * 100) AS INTEGER))
+                   OVER (PARTITION BY account ORDER BY date, id) AS pence
+        FROM transactions
+    ),
+    opening AS MATERIALIZED (
+        SELECT a.account,
+               COALESCE(CAST(ROUND(s.ledger_balance * 100) AS INTEGER), 0) - COALESCE((
+                   SELECT SUM(CAST(ROUND((t.paid_in - t.paid_out) * 100) AS INTEGER))
+                   FROM transactions t
+                   WHERE t.account = a.account AND t.date <= s.ledger_date
+               ), 0) AS pence
+        FROM (SELECT DISTINCT account FROM transactions) a
+        LEFT JOIN statement_balances s ON s.account = a.account
+    )
+    SELECT running.id, (opening.pence + running.pence) / 100.0 AS balance
+    FROM running JOIN opening ON opening.account = running.account
+'''
+
+# the balance after each account's last transaction of each day
+END_OF_DAY_BALANCES = '''
+    SELECT account, date, balance
+    FROM (
+        SELECT account, date, balance,
+               ROW_NUMBER() OVER (PARTITION BY account, date ORDER BY id DESC) AS rn
+        FROM transactions
+    )
+    WHERE rn = 1
+'''
+
+# every dated transaction with its categories, in date order, for the Parquet export
+EXPORT_ROWS = '''
+    SELECT t.id, substr(t.date, 1, 7), t.date, COALESCE(t.account, ''), COALESCE(t.transaction_type, ''),
+           COALESCE(t.description, ''), COALESCE(t.paid_in, 0), COALESCE(t.paid_out, 0),
+           COALESCE(t.paid_in, 0) - COALESCE(t.paid_out, 0), t.balance, c.rule_id,
+           COALESCE(r.main_category, 'Uncategorised'), COALESCE(r.sub1, ''),
+           COALESCE(r.sub2, ''), COALESCE(r.sub3, '')
+    FROM transactions t
+    LEFT JOIN categorised c ON c.transaction_id = t.id
+    LEFT JOIN categories r ON r.id = c.rule_id
+    WHERE COALESCE(t.date, '') != ''
+    ORDER BY t.date, t.id
+'''
+
+BALANCE_AS_OF = '''
+    SELECT balance FROM daily_balances
+    WHERE account = ? AND date <= ?
+    ORDER BY date DESC
+    LIMIT 1
+'''
+
+# the last end-of-day balance strictly before a date, e.g. the day before a statement starts
+BALANCE_BEFORE = '''
+    SELECT date, balance FROM daily_balances
+    WHERE account = ? AND date < ?
+    ORDER BY date DESC
+    LIMIT 1
+'''
+
+# plain "SCAN x": every row of a table read without an index (scans of a
+# "(subquery-N)" the plan already built are not counted)
+_FULL_SCAN = re.compile(r'^SCAN ([^\s(]\S*)$')
+
+
+def pipeline_queries():
+    """Every named pipeline query with sample parameters and what its plan should look like.
+
+    Each entry is a dict: name, source (the function that runs it), sql,
+    params, uses (strings its query plan must contain, normally index names)
+    and scans (tables or aliases the query reads in full by design).
+    """
+    where, params = search.search_query('TESCO STORES')
+    month_sql, month_params = cube.slice_sql(('main_category',), '2024-01', '2024-01')
+    cells_sql, cells_params = cube.cells_sql()
+    dirty_sql, dirty_params = cube.cells_sql({'2024-03', '2024-05'})
+    return [
+        {'name': 'uncategorised_pairs', 'source': 'list_uncategorised.list_uncategorised_transactions',
+         'sql': UNCATEGORISED_PAIRS, 'params': (), 'uses': ['idx_categorised_uncategorised'], 'scans': []},
+        {'name': 'uncategorised_rows', 'source': 'list_uncategorised.fetch_uncategorised',
+         'sql': UNCATEGORISED_ROWS, 'params': (), 'uses': ['idx_categorised_uncategorised'], 'scans': []},
+        {'name': 'transactions_with_categories', 'source': 'txn_arrays.load_arrays',
+         'sql': TRANSACTIONS_WITH_CATEGORIES, 'params': (), 'uses': ['idx_transactions_date'], 'scans': []},
+        {'name': 'categorise_transactions', 'source': 'categorise_md.categorise_in_python',
+         'sql': CATEGORISE_TRANSACTIONS, 'params': (), 'uses': [], 'scans': ['transactions']},
+        {'name': 'category_rules', 'source': 'categorise_md.main',
+         'sql': CATEGORY_RULES, 'params': (), 'uses': [], 'scans': ['categories']},
+        {'name': 'rule_hits', 'source': 'search.rule_hits',
+         'sql': search.fetch_sql('c.rule_id = ?', 100), 'params': (1,), 'uses': ['idx_categorised_rule'], 'scans': []},
+        {'name': 'search_text', 'source': 'search.search',
+         'sql': search.fetch_sql(where, 100), 'params': params, 'uses': [search.FTS_TABLE], 'scans': []},
+        {'name': 'balance_as_of', 'source': 'load_statement_ofx.balance_as_of',
+         'sql': BALANCE_AS_OF, 'params': ('', '2024-06-30'), 'uses': ['PRIMARY KEY'], 'scans': []},
+        {'name': 'balance_before', 'source': 'load_statement_ofx.reconcile',
+         'sql': BALANCE_BEFORE, 'params': ('', '2024-06-01'), 'uses': ['PRIMARY KEY'], 'scans': []},
+        {'name': 'rule_months', 'source': 'cube.changed_months',
+         'sql': cube.RULE_MONTHS, 'params': ('[1, 2]',), 'uses': ['idx_categorised_rule'], 'scans': []},
+        {'name': 'cube_month', 'source': 'cube.slice_cube',
+         'sql': month_sql, 'params': month_params, 'uses': ['PRIMARY KEY'], 'scans': []},
+        # whole-history rebuilds: reading every transaction is the point, but
+        # each join must stay a primary-key lookup
+        {'name': 'rollup_rows', 'source': 'rollups.rebuild_rollups',
+         'sql': rollups.ROLLUP_ROWS, 'params': (), 'uses': ['INTEGER PRIMARY KEY'], 'scans': ['t', 'base']},
+        {'name': 'cube_cells', 'source': 'cube.refresh_cube',
+         'sql': cells_sql, 'params': cells_params, 'uses': ['INTEGER PRIMARY KEY'], 'scans': ['t']},
+        {'name': 'cube_cells_months', 'source': 'cube.refresh_cube',
+         'sql': dirty_sql, 'params': dirty_params, 'uses': ['idx_transactions_date'], 'scans': []},
+        {'name': 'running_balances', 'source': 'load_statement_ofx.compute_balances',
+         'sql': RUNNING_BALANCES, 'params': (), 'scans': ['transactions', 'a', 'running'],
+         'uses': ['MATERIALIZE opening', 'idx_transactions_date', 'sqlite_autoindex_statement_balances_1']},
+        {'name': 'end_of_day_balances', 'source': 'load_statement_ofx.compute_balances',
+         'sql': END_OF_DAY_BALANCES, 'params': (), 'uses': [], 'scans': ['transactions']},
+        {'name': 'export_rows', 'source': 'export_store.export_store',
+         'sql': EXPORT_ROWS, 'params': (), 'uses': ['idx_transactions_date', 'INTEGER PRIMARY KEY'], 'scans': []},
+    ]
+
+
+def query_plan(conn, sql, params=()):
+    """The EXPLAIN QUERY PLAN detail lines for sql."""
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def full_scans(plan):
+    """Tables (or aliases) the plan reads in full without an index."""
+    return [m.group(1) for m in map(_FULL_SCAN.match, plan) if m]
+
+
+def check_query(conn, query):
+    """Plan one pipeline_queries() entry: {'plan', 'unexpected_scans', 'missing'}."""
+    plan = query_plan(conn, query['sql'], query['params'])
+    return {
+        'plan': plan,
+        'unexpected_scans': [s for s in full_scans(plan) if s not in query['scans']],
+        'missing': [u for u in query['uses'] if not any(u in line for line in plan)],
+    }
@@ -0,0 +1,116 @@
+import sqlite3
+import argparse
+
+import db_build
+import schema
+
+DB_FILE = 'load_statement.db'
+ROLLUP_TABLE = 'category_rollups'
+# joins the levels of a category path, e.g. 'WANT / EATING OUT / Coffee'
+PATH_SEP = ' / '
+LEVELS = ['main_category', 'sub1', 'sub2', 'sub3']
+
+
+def _level_sql(depth):
+    # path, parent and label for one depth; a level is only reached when it
+    # and every level above it are filled in
+    levels = [f'l{n}' for n in range(1, depth + 1)]
+    path = f" || '{PATH_SEP}' || ".join(levels)
+    parent = f" || '{PATH_SEP}' || ".join(levels[:-1]) or "''"
+    where = ' AND '.join(f"{l} != ''" for l in levels[1:]) or '1'
+    group = ', '.join(levels)
+    return f'''
+        SELECT month, {path}, {depth}, {parent}, l{depth},
+               sum(out_pence), sum(in_pence), count(*)
+        FROM base
+        WHERE {where}
+        GROUP BY month, {group}
+    '''
+
+
+# every rollup row, from the transactions and their rules
+ROLLUP_ROWS = '''
+    WITH base AS (
+        SELECT substr(t.date, 1, 7) AS month,
+               COALESCE(r.main_category, 'Uncategorised') AS l1,
+               COALESCE(r.sub1, '') AS l2,
+               COALESCE(r.sub2, '') AS l3,
+               COALESCE(r.sub3, '') AS l4,
+               CAST(round(COALESCE(t.paid_out, 0) * 100) AS INTEGER) AS out_pence,
+               CAST(round(COALESCE(t.paid_in, 0) * 100) AS INTEGER) AS in_pence
+        FROM transactions t
+        LEFT JOIN categorised c ON c.transaction_id = t.id
+        LEFT JOIN categories r ON r.id = c.rule_id
+        WHERE COALESCE(t.date, '') != ''
+    )
+''' + ' UNION ALL '.join(_level_sql(depth) for depth in range(1, len(LEVELS) + 1))
+
+
+def rebuild_rollups(conn):
+    """(Re)build the per-month totals for every level of the category hierarchy.
+
+    Each row is one node of the main_category / sub1 / sub2 / sub3 tree for
+    one month, keyed by its materialised path, with money out, money in and
+    the transaction count of everything beneath it. Amounts are in pence so
+    children never add up to more than their parent. Run after categorising;
+    returns the number of rows written.
+    """
+    conn.execute(f'DROP TABLE IF EXISTS {ROLLUP_TABLE}')
+    conn.execute(f'''
+        CREATE TABLE {ROLLUP_TABLE} (
+            month TEXT,
+            path TEXT,
+            depth INTEGER,
+            parent TEXT,
+            label TEXT,
+            out_pence INTEGER,
+            in_pence INTEGER,
+            txn_count INTEGER,
+            PRIMARY KEY (month, path)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'''
+        INSERT INTO {ROLLUP_TABLE} (month, path, depth, parent, label, out_pence, in_pence, txn_count)
+        {ROLLUP_ROWS}
+    ''')
+    return conn.execute(f'SELECT count(*) FROM {ROLLUP_TABLE}').fetchone()[0]
+
+
+def rebuild_rollups_db(db_file):
+    """Rebuild the rollups in a build copy of db_file and swap it in."""
+    conn = db_build.open_build_db(db_file, copy_existing=True)
+    count = rebuild_rollups(conn)
+    db_build.publish(conn, db_file)
+    return count
+
+
+def load_rollups(conn, max_depth=None):
+    """Rollup rows (month, path, depth, parent, label, out_pence, in_pence, txn_count), by month then path."""
+    sql = f'SELECT month, path, depth, parent, label, out_pence, in_pence, txn_count FROM {ROLLUP_TABLE}'
+    params = []
+    if max_depth:
+        sql += ' WHERE depth <= ?'
+        params.append(max_depth)
+    return conn.execute(sql + ' ORDER BY month, path', params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the category rollups, or show one month's tree.")
+    parser.add_argument('--month', help="Print the totals for this month (YYYY-MM)")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.require_current(conn, args.db)
+    if args.month:
+        schema.require_derived(conn, args.db, [ROLLUP_TABLE])
+        for month, path, depth, _, label, out_pence, in_pence, count in load_rollups(conn):
+            if month == args.month:
+                print(f"{'  ' * (depth - 1)}{label:<{40 - 2 * depth}} out £{out_pence / 100:>10,.2f}  in £{in_pence / 100:>10,.2f}  ({count})")
+    else:
+        print(f'Rebuilt {rebuild_rollups_db(args.db)} rollup rows.')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
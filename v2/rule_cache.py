@@ -0,0 +1,204 @@
+import csv
+import hashlib
+import os
+import pickle
+import re
+
+import rule_guard
+import rule_match
+from rule_match import compile_pattern
+
+# Bump when the cached layout changes (2: CODE_DIGEST stored with each
+# cache). Changes to the parsing and checking code need no bump: they
+# change CODE_DIGEST.
+CACHE_VERSION = 2
+CACHE_DIR = '.rule_cache'
+
+RULE_COLUMNS = ['transaction_type_pattern', 'description_pattern', 'main_category', 'sub1', 'sub2', 'sub3', 'notes']
+
+# rule files already loaded by this process, by content hash
+_loaded = {}
+
+
+def _code_digest():
+    # the modules whose output is cached: parsing here, rule_guard's issues
+    # and rule_match's compiled patterns
+    sha = hashlib.sha256()
+    for path in (__file__, rule_guard.__file__, rule_match.__file__):
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+CODE_DIGEST = _code_digest()
+
+
+def read_md_table(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [l.rstrip('\n') for l in f]
+
+    # find first table header line (starts with | and has | separators)
+    header_idx = None
+    for i, l in enumerate(lines):
+        if l.strip().startswith('|') and '|' in l.strip()[1:]:
+            header_idx = i
+            break
+
+    if header_idx is None or header_idx + 1 >= len(lines):
+        return [], []
+
+    header_line = lines[header_idx]
+    sep_line = lines[header_idx + 1]
+
+    # headers are the cells between | ... |
+    def split_row(line):
+        parts = [p.strip() for p in line.split('|')]
+        # remove leading/trailing empties caused by leading/trailing |
+        if parts and parts[0] == '':
+            parts = parts[1:]
+        if parts and parts[-1] == '':
+            parts = parts[:-1]
+        return parts
+
+    headers = split_row(header_line)
+
+    rows = []
+    for l in lines[header_idx + 2:]:
+        if not l.strip().startswith('|'):
+            # stop at first non-table line
+            break
+        # ignore separator-like lines
+        if set(l.strip()) <= set('| -:'):
+            continue
+        cells = split_row(l)
+        # pad to headers length
+        if len(cells) < len(headers):
+            cells += [''] * (len(headers) - len(cells))
+        rows.append(dict(zip(headers, cells)))
+
+    return headers, rows
+
+
+def split_v1_category(category, essential):
+    """The v2 columns for a v1 'MAIN;SUB;...' category and essential Y/N flag."""
+    levels = [c.strip() for c in (category or '').split(';')]
+    levels += [''] * (4 - len(levels))
+    rule = dict(zip(['main_category', 'sub1', 'sub2', 'sub3'], levels[:3] + [';'.join(levels[3:]).strip(';')]))
+    rule['notes'] = 'essential' if (essential or '').strip().upper() == 'Y' else ''
+    return rule
+
+
+def read_csv_rules(path):
+    """Read category rules from the v1 CSV format or the older v2 CSV format.
+
+    v1 rows have a 'category' such as 'EATING OUT;COFFEE' and an 'essential'
+    flag, which become main_category/sub1/... and a note. Blank rows and rows
+    starting with '#' are skipped.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        headers = reader.fieldnames or []
+        v1_format = 'category' in headers and 'main_category' not in headers
+        rows = []
+        for row in reader:
+            values = [(v or '').strip() for v in row.values() if isinstance(v, str)]
+            if not any(values) or values[0].startswith('#'):
+                continue
+            rule = {
+                'transaction_type_pattern': row.get('transaction_type_pattern') or row.get('transaction_type') or '',
+                'description_pattern': row.get('description_pattern') or row.get('description') or '',
+            }
+            if v1_format:
+                rule.update(split_v1_category(row.get('category'), row.get('essential')))
+            else:
+                for col in RULE_COLUMNS[2:]:
+                    rule[col] = row.get(col) or ''
+            rows.append(rule)
+    return headers, rows
+
+
+def parse_rules(path):
+    """Parse a rules file (markdown table or CSV) into rows keyed by RULE_COLUMNS."""
+    if path.lower().endswith('.csv'):
+        return read_csv_rules(path)
+    return read_md_table(path)
+
+
+def missing_category(rows):
+    """Rows (keyed by RULE_COLUMNS) whose main_category is still blank, e.g. pasted suggest_rules.py output."""
+    return [r for r in rows if not (r.get('main_category') or '').strip()]
+
+
+def _serialise_pattern(pattern):
+    # (pattern, stripped pattern, literal, stripped literal); a pattern is None
+    # when it does not compile, so loading never needs try/except
+    primary, fallback, literal, fallback_literal = compile_pattern(pattern)
+    return (primary and primary.pattern, fallback and fallback.pattern, literal, fallback_literal)
+
+
+def _rebuild_pattern(serialised):
+    primary, fallback, literal, fallback_literal = serialised
+    return (
+        re.compile(primary, re.IGNORECASE) if primary is not None else None,
+        re.compile(fallback, re.IGNORECASE) if fallback is not None else None,
+        literal,
+        fallback_literal,
+    )
+
+
+def _build(path, digest):
+    headers, rows = parse_rules(path)
+    rows = [{col: r.get(col, '') for col in RULE_COLUMNS} for r in rows]
+    category_rules = [tuple(r[col] for col in RULE_COLUMNS) for r in rows]
+    return {
+        'version': CACHE_VERSION,
+        'code': CODE_DIGEST,
+        'hash': digest,
+        'headers': headers,
+        'rows': rows,
+        'patterns': [(_serialise_pattern(r[0]), _serialise_pattern(r[1])) for r in category_rules],
+        'issues': rule_guard.check_rules(category_rules),
+    }
+
+
+def cache_path(path):
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, CACHE_DIR, name + '.pickle')
+
+
+def load_rules(path):
+    """Load a rules file, reusing the parsed and checked rules while it is unchanged.
+
+    Returns a dict with 'hash' (sha256 of the file), 'headers', 'rows'
+    (dicts keyed by RULE_COLUMNS), 'compiled' (for rule_match.match_rule)
+    and 'issues' (rule_guard.check_rules output).
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if digest in _loaded:
+        return _loaded[digest]
+
+    cached = None
+    cache_file = cache_path(path)
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        pass
+    if not cached or cached.get('version') != CACHE_VERSION or cached.get('code') != CODE_DIGEST \
+            or cached.get('hash') != digest:
+        cached = _build(path, digest)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = cache_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            # a read-only folder just means no cache next time
+            pass
+
+    ruleset = dict(cached)
+    ruleset['compiled'] = [(_rebuild_pattern(t), _rebuild_pattern(d)) for t, d in cached['patterns']]
+    _loaded[digest] = ruleset
+    return ruleset
@@ -0,0 +1,221 @@
+import re
+import multiprocessing
+from time import perf_counter
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from rule_match import compile_pattern, pattern_search
+
+# Seconds a single rule may spend matching the whole sample set before it is
+# quarantined; a rule still running after RULE_HARD_TIMEOUT is killed.
+RULE_TIME_BUDGET = 0.25
+RULE_HARD_TIMEOUT = 2.0
+SAMPLE_LIMIT = 2000
+
+# Classic backtracking triggers: a long run of one character then a mismatch
+STRESS_INPUTS = ['a' * 64 + '!', ' ' * 64 + '!', '0' * 64 + '!', 'A1 ' * 32 + '!']
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+_ANY_CHAR = 'any'
+
+
+def _children(op, av):
+    if op in _REPEATS or op == getattr(sre_parse, 'POSSESSIVE_REPEAT', None):
+        yield av[2]
+    elif op == sre_parse.SUBPATTERN:
+        yield av[-1]
+    elif op == sre_parse.BRANCH:
+        yield from av[1]
+    elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        yield av
+    elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        yield av[1]
+    elif op == sre_parse.GROUPREF_EXISTS:
+        yield av[1]
+        if av[2] is not None:
+            yield av[2]
+
+
+def _is_unbounded(op, av):
+    return op in _REPEATS and (av[1] == sre_parse.MAXREPEAT or av[1] > 1)
+
+
+def _contains_repeat(items):
+    for op, av in items:
+        if _is_unbounded(op, av):
+            return True
+        if any(_contains_repeat(child) for child in _children(op, av)):
+            return True
+    return False
+
+
+def _first_chars(items):
+    """Characters a subpattern can start with; _ANY_CHAR when not simple."""
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            return {chr(av).lower()}
+        if op == sre_parse.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op == sre_parse.AT:
+            continue
+        return _ANY_CHAR
+    return set()
+
+
+def _overlaps(a, b):
+    return a == _ANY_CHAR or b == _ANY_CHAR or bool(a & b)
+
+
+def _single_char(items):
+    items = list(items)
+    if len(items) != 1:
+        return None
+    op, av = items[0]
+    if op == sre_parse.LITERAL:
+        return {chr(av).lower()}
+    if op in (sre_parse.ANY, sre_parse.IN, sre_parse.NOT_LITERAL):
+        return _ANY_CHAR
+    return None
+
+
+def _branches(items):
+    # alternations directly inside a quantified body, looking through groups
+    for op, av in items:
+        if op == sre_parse.BRANCH:
+            yield av[1]
+        elif op == sre_parse.SUBPATTERN:
+            yield from _branches(av[-1])
+
+
+def _scan(items, problems):
+    prev_chars = None
+    for op, av in items:
+        if _is_unbounded(op, av):
+            body = av[2]
+            if _contains_repeat(body):
+                problems.add('nested quantifier (e.g. (a+)+) can backtrack exponentially')
+            for alternatives in _branches(body):
+                starts = [_first_chars(alt) for alt in alternatives]
+                if any(_overlaps(starts[i], starts[j])
+                       for i in range(len(starts)) for j in range(i + 1, len(starts))):
+                    problems.add('repeated alternation with overlapping branches can backtrack exponentially')
+            chars = _single_char(body)
+            if chars is not None and prev_chars is not None and _overlaps(chars, prev_chars):
+                problems.add('adjacent overlapping quantifiers (e.g. .*.*) are slow on long text')
+            prev_chars = chars
+        else:
+            prev_chars = None
+        for child in _children(op, av):
+            _scan(child, problems)
+
+
+def check_pattern(pattern):
+    """Statically check one pattern; returns a list of problem descriptions."""
+    pattern = pattern or ''
+    problems = set()
+    # regex_search() also tries the pattern with whitespace removed
+    for candidate in dict.fromkeys([pattern, re.sub(r'\s+', '', pattern)]):
+        try:
+            parsed = sre_parse.parse(candidate, re.IGNORECASE)
+        except re.error as e:
+            if candidate == pattern:
+                return [f'invalid regex ({e}); rule can never match']
+            continue
+        _scan(list(parsed), problems)
+    return sorted(problems)
+
+
+def check_rules(category_rules):
+    """Return {rule index: [problems]} for (type_pattern, desc_pattern, ...) rows."""
+    issues = {}
+    for i, rule in enumerate(category_rules):
+        problems = []
+        for label, pattern in (('transaction_type_pattern', rule[0]), ('description_pattern', rule[1])):
+            problems += [f'{label}: {p}' for p in check_pattern(pattern)]
+        if problems:
+            issues[i] = problems
+    return issues
+
+
+def sample_inputs(cursor, limit=SAMPLE_LIMIT):
+    rows = cursor.execute(
+        'SELECT DISTINCT transaction_type, description FROM transactions LIMIT ?', (limit,)
+    ).fetchall()
+    samples = [(t or '', d or '') for t, d in rows]
+    return samples + [(s, s) for s in STRESS_INPUTS]
+
+
+def _profile_worker(jobs, samples, out):
+    # a Pipe rather than a Queue: a runaway regex holds the GIL, which would
+    # stop a Queue's feeder thread from delivering the results already made
+    out.send(('ready', None))
+    for idx, type_pattern, desc_pattern in jobs:
+        type_compiled = compile_pattern(type_pattern)
+        desc_compiled = compile_pattern(desc_pattern)
+        start = perf_counter()
+        for txn_type, desc in samples:
+            pattern_search(type_compiled, txn_type)
+            pattern_search(desc_compiled, desc)
+        out.send((idx, perf_counter() - start))
+
+
+def profile_rules(category_rules, samples, indexes=None, budget=RULE_TIME_BUDGET,
+                  hard_timeout=RULE_HARD_TIMEOUT):
+    """Time rules against the samples in a child process.
+
+    Returns ({rule index: seconds} for rules over budget, [indexes of rules
+    never timed]); a rule that had to be killed after hard_timeout is
+    reported as None, and rules are left untimed only when a worker process
+    fails to start. Runs out of process because a runaway regex cannot be
+    interrupted from Python.
+    """
+    if indexes is None:
+        indexes = range(len(category_rules))
+    jobs = [(i, category_rules[i][0], category_rules[i][1]) for i in indexes]
+    hard_timeout = max(hard_timeout, budget)
+    over_budget, untimed = {}, []
+
+    ctx = multiprocessing.get_context()
+    while jobs:
+        reader, writer = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_profile_worker, args=(jobs, samples, writer), daemon=True)
+        proc.start()
+        writer.close()
+        try:
+            try:
+                started = reader.poll(60) and reader.recv()  # process start-up, slow on Windows
+            except EOFError:
+                started = False
+            if not started:
+                # the worker could not start; the caller reports what is left
+                untimed = [job[0] for job in jobs]
+                break
+            while jobs:
+                message = None
+                if reader.poll(hard_timeout):
+                    try:
+                        message = reader.recv()
+                    except EOFError:
+                        pass
+                if message is None:
+                    # the first unfinished rule is stuck (or took the worker
+                    # down with it); drop it and restart
+                    over_budget[jobs.pop(0)[0]] = None
+                    break
+                idx, elapsed = message
+                jobs.pop(0)
+                if elapsed > budget:
+                    over_budget[idx] = elapsed
+        finally:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+            reader.close()
+    return over_budget, untimed
+
+
+def format_rule(category_rules, idx):
+    return f'rule {idx + 1} ({category_rules[idx][0]} | {category_rules[idx][1]})'
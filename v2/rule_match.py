@@ -0,0 +1,117 @@
+import re
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def required_literal(pattern):
+    """Longest run of plain ASCII characters every match must contain, lower-cased.
+
+    Used as a cheap substring prefilter before running the regex; '' when
+    the pattern has no such run.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except re.error:
+        return ''
+    best = run = ''
+    for op, av in parsed:
+        if op == sre_parse.LITERAL and av < 128:
+            run += chr(av).lower()
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ''
+    return best
+
+
+def compile_pattern(pattern):
+    """Compile a rule pattern once, with the same semantics as regex_search().
+
+    Returns (primary, fallback, literal, fallback_literal): primary is None
+    for an invalid pattern (which never matches), fallback is the
+    whitespace-insensitive retry (None if stripping the whitespace makes the
+    pattern invalid) and the literals are their required_literal()s.
+    """
+    pattern = pattern or ''
+    try:
+        primary = re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        return None, None, '', ''
+    stripped = _WHITESPACE.sub('', pattern)
+    try:
+        fallback = re.compile(stripped, re.IGNORECASE)
+    except re.error:
+        return primary, None, required_literal(pattern), ''
+    return primary, fallback, required_literal(pattern), required_literal(stripped)
+
+
+def prepare_text(text):
+    """Precompute the text variants pattern searches need, once per text."""
+    text = text or ''
+    stripped = _WHITESPACE.sub('', text)
+    if not text.isascii():
+        # lower() and IGNORECASE disagree on a few non-ASCII characters, so
+        # the literal prefilter is only trusted on ASCII text
+        return text, stripped, None, None
+    return text, stripped, text.lower(), stripped.lower()
+
+
+def search_prepared(compiled, prepared):
+    primary, fallback, literal, fallback_literal = compiled
+    if primary is None:
+        return False
+    text, stripped, lower, stripped_lower = prepared
+    if (lower is None or literal in lower) and primary.search(text):
+        return True
+    if fallback is None:
+        return False
+    if stripped_lower is not None and fallback_literal not in stripped_lower:
+        return False
+    return fallback.search(stripped) is not None
+
+
+def pattern_search(compiled, text):
+    return search_prepared(compiled, prepare_text(text))
+
+
+def compile_rules(category_rules):
+    """Compile (transaction_type_pattern, description_pattern, ...) rows."""
+    return [(compile_pattern(r[0]), compile_pattern(r[1])) for r in category_rules]
+
+
+def match_rule(compiled_rules, txn_type, desc, skip=()):
+    """Return the index of the first rule matching the transaction, or None.
+
+    Rule indexes in skip (e.g. quarantined rules) are never tried.
+    """
+    txn_type = prepare_text(txn_type)
+    desc = prepare_text(desc)
+    for i, (type_compiled, desc_compiled) in enumerate(compiled_rules):
+        if i in skip:
+            continue
+        if search_prepared(type_compiled, txn_type) and search_prepared(desc_compiled, desc):
+            return i
+    return None
+
+
+REGEXP_CACHE_SIZE = 1024
+
+cached_pattern = lru_cache(maxsize=REGEXP_CACHE_SIZE)(compile_pattern)
+# SQLite tries every rule against one transaction before moving on
+cached_text = lru_cache(maxsize=64)(prepare_text)
+
+
+def sqlite_regexp(pattern, text):
+    # SQLite calls regexp(Y, X) for "X REGEXP Y"
+    return search_prepared(cached_pattern(pattern), cached_text(text))
+
+
+def register_regexp(conn):
+    """Make "text REGEXP pattern" available on conn, with regex_search() semantics."""
+    conn.create_function('REGEXP', 2, sqlite_regexp, deterministic=True)
@@ -0,0 +1,444 @@
+import sqlite3
+import sys
+import argparse
+
+import cube
+import rollups
+from rule_cache import RULE_COLUMNS, split_v1_category
+
+DB_FILE = 'load_statement.db'
+
+# Tables rebuilt from the ones below by their own modules (rollups.py,
+# cube.py); an upgrade that rewrites categorised drops them and migrate()
+# rebuilds them before it returns, so readers never have to.
+DERIVED_TABLES = ['category_rollups', 'category_cube']
+
+# The v1 loader and the original v2 loader both added this last-resort rule
+# so that unmatched transactions showed 'Uncategorised'; now they simply have
+# no rule.
+CATCH_ALL_CATEGORY = 'Uncategorised'
+
+TABLES = {
+    'transactions': '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account TEXT,
+            date TEXT,
+            transaction_type TEXT,
+            description TEXT,
+            paid_out REAL,
+            paid_in REAL,
+            balance REAL
+        )
+    ''',
+    # one rule per row of categories.md: regex patterns and the category they
+    # assign. Rules are tried in position (file) order; a rule keeps its id
+    # while its patterns stay the same, and ids are never reused.
+    'categories': '''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_type_pattern TEXT,
+            description_pattern TEXT,
+            main_category TEXT,
+            sub1 TEXT,
+            sub2 TEXT,
+            sub3 TEXT,
+            notes TEXT,
+            position INTEGER
+        )
+    ''',
+    # the rule that matched each transaction; the category strings live on
+    # the rule, and a NULL rule_id means Uncategorised
+    'categorised': '''
+        CREATE TABLE IF NOT EXISTS categorised (
+            transaction_id INTEGER PRIMARY KEY,
+            rule_id INTEGER,
+            FOREIGN KEY(transaction_id) REFERENCES transactions(id),
+            FOREIGN KEY(rule_id) REFERENCES categories(id)
+        )
+    ''',
+    'meta': 'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    # closing balance per account as reported by the bank
+    'statement_balances': '''
+        CREATE TABLE IF NOT EXISTS statement_balances (
+            account TEXT PRIMARY KEY,
+            ledger_balance REAL,
+            ledger_date TEXT
+        )
+    ''',
+    # end-of-day balance per account, for "balance as of date X" lookups
+    'daily_balances': '''
+        CREATE TABLE IF NOT EXISTS daily_balances (
+            account TEXT,
+            date TEXT,
+            balance REAL,
+            PRIMARY KEY (account, date)
+        ) WITHOUT ROWID
+    ''',
+}
+
+# The two categorised indexes split the table between them: matched rows by
+# rule, for rule hit lists (search.py --rule), and the uncategorised rows
+# list_uncategorised.py reads.
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_categorised_rule ON categorised (rule_id) WHERE rule_id IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_categorised_uncategorised ON categorised (transaction_id) WHERE rule_id IS NULL',
+    # date ranges and date-ordered reads
+    'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)',
+]
+
+
+def _columns(conn, table):
+    return [r[1] for r in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def _drop_derived(conn):
+    for table in DERIVED_TABLES:
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+def _replace_categorised(conn, select, params=()):
+    """Swap in a (transaction_id, rule_id) categorised table filled by select.
+
+    Transactions the select leaves out are added as Uncategorised.
+    """
+    conn.execute('DROP TABLE IF EXISTS categorised_new')
+    conn.execute(TABLES['categorised'].replace('categorised', 'categorised_new', 1))
+    conn.execute(f'INSERT INTO categorised_new (transaction_id, rule_id) {select}', params)
+    conn.execute('''
+        INSERT INTO categorised_new (transaction_id, rule_id)
+        SELECT id, NULL FROM transactions
+        WHERE id NOT IN (SELECT transaction_id FROM categorised_new)
+    ''')
+    conn.execute('DROP TABLE categorised')
+    conn.execute('ALTER TABLE categorised_new RENAME TO categorised')
+    _drop_derived(conn)
+
+
+def _unlink_catch_all(conn):
+    """Make transactions categorised 'Uncategorised' rule-less and drop the catch-all rule.
+
+    Returns how many transactions were unlinked.
+    """
+    unlinked = conn.execute('''
+        UPDATE categorised SET rule_id = NULL
+        WHERE rule_id IN (SELECT id FROM categories WHERE main_category = ?)
+    ''', (CATCH_ALL_CATEGORY,)).rowcount
+    dropped = conn.execute('''
+        DELETE FROM categories
+        WHERE transaction_type_pattern = '.*' AND description_pattern = '.*' AND main_category = ?
+    ''', (CATCH_ALL_CATEGORY,)).rowcount
+    if dropped:
+        # the rules no longer match any rule file's hash
+        conn.execute("DELETE FROM meta WHERE key = 'rules_hash'")
+    if unlinked or dropped:
+        _drop_derived(conn)
+    return unlinked
+
+
+def create_tables(conn):
+    """Version 1: every table, in its current layout, where missing.
+
+    Databases from before accounts were tracked get an empty account column.
+    """
+    for ddl in TABLES.values():
+        conn.execute(ddl)
+    if 'account' not in _columns(conn, 'transactions'):
+        conn.execute('ALTER TABLE transactions ADD COLUMN account TEXT')
+
+
+def upgrade_v1_categories(conn):
+    """Version 2: convert a v1 database's 'MAIN;SUB' category and essential columns.
+
+    Each v1 rule keeps its id and becomes main_category/sub1/sub2/sub3 with
+    'essential' in its notes, the same way rule_cache reads a v1 CSV. Each
+    transaction is linked to the lowest-id rule carrying the category (and,
+    where one does, the essential flag) it was given; v1 kept no rule ids,
+    but rules with equal category strings show the same everywhere.
+    'Uncategorised' transactions get no rule, and the loader's '.*' catch-all
+    rule is dropped.
+    """
+    if 'category' not in _columns(conn, 'categories'):
+        return
+    if 'category' in _columns(conn, 'categorised'):
+        _replace_categorised(conn, '''
+            SELECT cg.transaction_id, CASE WHEN COALESCE(cg.category, ?) = ? THEN NULL ELSE COALESCE(
+                (SELECT min(r.id) FROM categories r
+                 WHERE r.category = cg.category AND COALESCE(r.essential, 'N') = COALESCE(cg.essential, 'N')),
+                (SELECT min(r.id) FROM categories r WHERE r.category = cg.category)) END
+            FROM categorised cg
+        ''', (CATCH_ALL_CATEGORY, CATCH_ALL_CATEGORY))
+
+    rules = conn.execute('''
+        SELECT id, transaction_type_pattern, description_pattern, category, essential
+        FROM categories ORDER BY id
+    ''').fetchall()
+    conn.execute('DROP TABLE IF EXISTS categories_new')
+    conn.execute(TABLES['categories'].replace('categories', 'categories_new', 1))
+    rows = []
+    for rule_id, type_pattern, desc_pattern, category, essential in rules:
+        split = split_v1_category(category, essential)
+        rows.append((rule_id, type_pattern, desc_pattern) + tuple(split[col] for col in RULE_COLUMNS[2:]))
+    conn.executemany(f'''
+        INSERT INTO categories_new (id, {', '.join(RULE_COLUMNS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.execute('DROP TABLE categories')
+    conn.execute('ALTER TABLE categories_new RENAME TO categories')
+    # the rules no longer match any rule file's hash
+    conn.execute("DELETE FROM meta WHERE key = 'rules_hash'")
+    _drop_derived(conn)
+    _unlink_catch_all(conn)
+
+
+def upgrade_categorised_rule_id(conn):
+    """Version 3: replace v2 categorised rows that copied the category strings with the rule's id.
+
+    Each transaction is linked to the lowest-id rule with the same
+    main_category/sub1/sub2/sub3; 'Uncategorised' rows get no rule, and the
+    loader's '.*' catch-all rule is dropped.
+    """
+    if 'rule_id' in _columns(conn, 'categorised'):
+        return
+    _replace_categorised(conn, '''
+        SELECT cg.transaction_id, CASE WHEN COALESCE(cg.main_category, ?) = ? THEN NULL ELSE
+            (SELECT min(r.id) FROM categories r
+             WHERE COALESCE(r.main_category, '') = COALESCE(cg.main_category, '')
+               AND COALESCE(r.sub1, '') = COALESCE(cg.sub1, '')
+               AND COALESCE(r.sub2, '') = COALESCE(cg.sub2, '')
+               AND COALESCE(r.sub3, '') = COALESCE(cg.sub3, '')) END
+        FROM categorised cg
+    ''', (CATCH_ALL_CATEGORY, CATCH_ALL_CATEGORY))
+    _unlink_catch_all(conn)
+
+
+def create_indexes(conn):
+    """Version 4: the indexes in INDEXES.
+
+    idx_categorised_rule used to cover every row; it is recreated partial.
+    """
+    conn.execute('DROP INDEX IF EXISTS idx_categorised_rule')
+    for sql in INDEXES:
+        conn.execute(sql)
+
+
+def unlink_catch_all(conn):
+    """Version 5: repair databases upgraded by versions 2-3 before they left
+    'Uncategorised' transactions linked to the loader's catch-all rule."""
+    _unlink_catch_all(conn)
+
+
+def add_rule_positions(conn):
+    """Version 6: order rules by a position column rather than by id, so
+    categorise_md.py can keep ids stable when the rule file is edited."""
+    if 'position' not in _columns(conn, 'categories'):
+        conn.execute('ALTER TABLE categories ADD COLUMN position INTEGER')
+    conn.execute('UPDATE categories SET position = id WHERE position IS NULL')
+
+
+# (version, description, step); append new steps, never edit applied ones
+MIGRATIONS = [
+    (1, 'create tables', create_tables),
+    (2, 'upgrade v1 category/essential columns', upgrade_v1_categories),
+    (3, 'link categorised to rule ids', upgrade_categorised_rule_id),
+    (4, 'add indexes', create_indexes),
+    (5, "unlink the 'Uncategorised' catch-all rule", unlink_catch_all),
+    (6, 'order rules by position', add_rule_positions),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def require_current(conn, db_file=DB_FILE):
+    """Exit with a message unless db_file holds loaded data at the current schema version.
+
+    Scripts that only read the database call this rather than migrate(), so
+    the schema is only ever changed by the loader, categorise_md.py and this
+    script.
+    """
+    if not _table_exists(conn, 'transactions'):
+        print(f"⛔ {db_file} has no transactions; run load_statement_ofx.py first.")
+        sys.exit(1)
+    version = schema_version(conn)
+    if version < SCHEMA_VERSION:
+        print(f"⛔ {db_file} is at schema version {version}, older than this code ({SCHEMA_VERSION}); "
+              f"run `py schema.py --db {db_file}` (or categorise_md.py) to upgrade it.")
+        sys.exit(1)
+
+
+def require_derived(conn, db_file=DB_FILE, tables=DERIVED_TABLES):
+    """Exit with a message unless db_file has the given derived tables.
+
+    Readers never build them: categorise_md.py (or the loader) does, in a
+    build copy that is swapped in when complete.
+    """
+    missing = [table for table in tables if not _table_exists(conn, table)]
+    if missing:
+        print(f"⛔ {db_file} has no {', '.join(missing)}; run categorise_md.py to build "
+              f"{'it' if len(missing) == 1 else 'them'}.")
+        sys.exit(1)
+
+
+def migrate(conn):
+    """Bring the database up to SCHEMA_VERSION, creating it if empty.
+
+    Steps already recorded in PRAGMA user_version are skipped; each step
+    runs in its own transaction (unless the caller already has one open)
+    and records its version when it succeeds. Returns the descriptions of
+    the steps applied, empty when the database was already current.
+    """
+    version = schema_version(conn)
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute('BEGIN')
+        try:
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+        except sqlite3.Error:
+            if own_transaction:
+                conn.rollback()
+            raise
+        if own_transaction:
+            conn.commit()
+        applied.append(description)
+    if applied:
+        applied += [f'rebuild {table}' for table in rebuild_derived(conn)]
+    return applied
+
+
+def rebuild_derived(conn):
+    """Build the DERIVED_TABLES the database lacks from its categorised transactions.
+
+    An upgrade that rewrites categorised drops them and a v1 database never
+    had them; migrate() calls this so they are back before anything reads
+    them. Returns the names of the tables built.
+    """
+    builders = {rollups.ROLLUP_TABLE: rollups.rebuild_rollups, cube.CUBE_TABLE: cube.refresh_cube}
+    missing = [table for table in DERIVED_TABLES if not _table_exists(conn, table)]
+    if not missing:
+        return []
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute('BEGIN')
+    try:
+        for table in missing:
+            builders[table](conn)
+    except sqlite3.Error:
+        if own_transaction:
+            conn.rollback()
+        raise
+    if own_transaction:
+        conn.commit()
+    return missing
+
+
+# Old layouts as their loaders left them: a TESCO transaction matched by a
+# rule and an unmatched one given the catch-all rule. The v4 fixture is a
+# database upgraded before version 5 existed.
+_FIXTURES = {
+    'v1': '''
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, transaction_type TEXT,
+                                   description TEXT, paid_out REAL, paid_in REAL, balance REAL);
+        CREATE TABLE categories (id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_type_pattern TEXT,
+                                 description_pattern TEXT, category TEXT, essential TEXT);
+        CREATE TABLE categorised (transaction_id INTEGER PRIMARY KEY, category TEXT, essential TEXT);
+        INSERT INTO categories VALUES (1, '.*', '^TESCO', 'NEED;FOOD', 'Y'), (2, '.*', '.*', 'Uncategorised', 'N');
+        INSERT INTO categorised VALUES (1, 'NEED;FOOD', 'Y'), (2, 'Uncategorised', 'N');
+    ''',
+    'original v2': '''
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, transaction_type TEXT,
+                                   description TEXT, paid_out REAL, paid_in REAL, balance REAL);
+        CREATE TABLE categories (id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_type_pattern TEXT,
+                                 description_pattern TEXT, main_category TEXT, sub1 TEXT, sub2 TEXT, sub3 TEXT, notes TEXT);
+        CREATE TABLE categorised (transaction_id INTEGER PRIMARY KEY, main_category TEXT, sub1 TEXT, sub2 TEXT,
+                                  sub3 TEXT, notes TEXT);
+        INSERT INTO categories VALUES (1, '.*', '^TESCO', 'NEED', 'FOOD', '', '', ''),
+                                      (2, '.*', '.*', 'Uncategorised', '', '', '', '');
+        INSERT INTO categorised VALUES (1, 'NEED', 'FOOD', '', '', ''), (2, 'Uncategorised', '', '', '', '');
+    ''',
+    'v4': '''
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, account TEXT, date TEXT,
+                                   transaction_type TEXT, description TEXT, paid_out REAL, paid_in REAL, balance REAL);
+        CREATE TABLE categories (id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_type_pattern TEXT,
+                                 description_pattern TEXT, main_category TEXT, sub1 TEXT, sub2 TEXT, sub3 TEXT, notes TEXT);
+        CREATE TABLE categorised (transaction_id INTEGER PRIMARY KEY, rule_id INTEGER);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        INSERT INTO categories VALUES (1, '.*', '^TESCO', 'NEED', 'FOOD', '', '', ''),
+                                      (2, '.*', '.*', 'Uncategorised', '', '', '', '');
+        INSERT INTO categorised VALUES (1, 1), (2, 2);
+        PRAGMA user_version = 4;
+    ''',
+}
+
+
+def check_upgrades():
+    """Migrate each _FIXTURES database in memory; returns the failure messages."""
+    failures = []
+    for name, script in _FIXTURES.items():
+        conn = sqlite3.connect(':memory:')
+        conn.executescript(script)
+        conn.execute("INSERT INTO transactions (id, date, transaction_type, description, paid_out, paid_in, balance) "
+                     "VALUES (1, '2024-01-02', 'DEB', 'TESCO STORES', 5, 0, 0), "
+                     "(2, '2024-01-03', 'DEB', 'SHELL', 40, 0, 0)")
+        conn.commit()
+        migrate(conn)
+        categorised = conn.execute('SELECT transaction_id, rule_id FROM categorised ORDER BY 1').fetchall()
+        rules = conn.execute('SELECT id, main_category, sub1 FROM categories ORDER BY id').fetchall()
+        if categorised != [(1, 1), (2, None)]:
+            failures.append(f'{name}: categorised is {categorised}, expected [(1, 1), (2, None)]')
+        if rules != [(1, 'NEED', 'FOOD')]:
+            failures.append(f"{name}: categories is {rules}, expected [(1, 'NEED', 'FOOD')]")
+        if schema_version(conn) != SCHEMA_VERSION:
+            failures.append(f'{name}: left at schema version {schema_version(conn)}')
+        missing = [table for table in DERIVED_TABLES if not _table_exists(conn, table)]
+        if missing:
+            failures.append(f"{name}: {', '.join(missing)} not rebuilt")
+        elif conn.execute(f"SELECT txn_count FROM {rollups.ROLLUP_TABLE} WHERE path = 'Uncategorised'").fetchall() != [(1,)]:
+            failures.append(f'{name}: {rollups.ROLLUP_TABLE} does not match categorised')
+        conn.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or upgrade the database schema in place.")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    parser.add_argument('--check', action='store_true',
+                        help="Instead, upgrade small v1 and older v2 databases in memory and check the result")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_upgrades()
+        for failure in failures:
+            print(f'⛔ {failure}')
+        if failures:
+            sys.exit(1)
+        print(f'✅ v1 and older v2 databases upgrade to schema version {SCHEMA_VERSION} as expected.')
+        return
+
+    conn = sqlite3.connect(args.db)
+    before = schema_version(conn)
+    applied = migrate(conn)
+    if applied:
+        print(f"✅ Upgraded {args.db} from schema version {before} to {schema_version(conn)}:")
+        for description in applied:
+            print(f"  - {description}")
+    elif before > SCHEMA_VERSION:
+        print(f"⚠️ {args.db} is at schema version {before}, newer than this code ({SCHEMA_VERSION}).")
+    else:
+        print(f"{args.db} is already at schema version {before}.")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import sqlite3
+import sys
+import argparse
+
+import db_build
+import schema
+from rule_match import compile_pattern, prepare_text, search_prepared
+
+DB_FILE = 'load_statement.db'
+FTS_TABLE = 'transactions_fts'
+# trigram needs at least this many characters in a search term
+MIN_TERM = 3
+
+
+def fts_available(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,)
+    ).fetchone() is not None
+
+
+def index_transactions(conn):
+    """(Re)build the full-text index over transaction descriptions.
+
+    The trigram tokenizer gives case-insensitive substring search. A second
+    column holds each description with its whitespace removed, matching the
+    whitespace-insensitive retry in regex_search(). Called by the loader on
+    its build database after inserting transactions; readers never build it
+    and search without it if it is missing. Returns the number of rows indexed.
+    """
+    conn.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            description, squashed, transaction_type UNINDEXED,
+            tokenize = 'trigram'
+        )
+    ''')
+    rows = conn.execute('SELECT id, description, transaction_type FROM transactions')
+    conn.executemany(
+        f'INSERT INTO {FTS_TABLE} (rowid, description, squashed, transaction_type) VALUES (?, ?, ?, ?)',
+        ((txn_id, desc or '', prepare_text(desc)[1], txn_type or '') for txn_id, desc, txn_type in rows)
+    )
+    return conn.execute(f'SELECT count(*) FROM {FTS_TABLE}').fetchone()[0]
+
+
+def rebuild_index(db_file):
+    """Re-index db_file's transactions in a build copy and swap it in."""
+    conn = db_build.open_build_db(db_file, copy_existing=True)
+    count = index_transactions(conn)
+    db_build.publish(conn, db_file)
+    return count
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+RESULT_COLUMNS = ['id', 'date', 'transaction_type', 'description', 'paid_in', 'paid_out', 'main_category', 'sub1']
+
+
+def fetch_sql(where, limit=None):
+    """The query behind every search: transactions matching where, newest first."""
+    sql = f'''
+        SELECT t.id, t.date, t.transaction_type, t.description, t.paid_in, t.paid_out,
+               COALESCE(r.main_category, 'Uncategorised'), COALESCE(r.sub1, '')
+        FROM transactions t
+        LEFT JOIN categorised c ON c.transaction_id = t.id
+        LEFT JOIN categories r ON r.id = c.rule_id
+        WHERE {where}
+        ORDER BY t.date DESC, t.id DESC
+    '''
+    if limit:
+        sql += ' LIMIT %d' % int(limit)
+    return sql
+
+
+def _fetch(conn, where, params, limit):
+    return conn.execute(fetch_sql(where, limit), params).fetchall()
+
+
+def search_query(text, use_index=True):
+    """The where clause and parameters search() uses for text.
+
+    Without the index every word is a LIKE filter over all transactions.
+    """
+    terms = text.split()
+    long_terms = [t for t in terms if len(t) >= MIN_TERM] if use_index else []
+    short_terms = [t for t in terms if t not in long_terms]
+    clauses, params = [], []
+    if long_terms:
+        clauses.append(f't.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)')
+        params.append('description : (' + ' AND '.join(_phrase(t) for t in long_terms) + ')')
+    for t in short_terms:
+        # too short for trigrams (or no index); filter with LIKE
+        clauses.append("t.description LIKE ? ESCAPE '\\'")
+        params.append('%' + t.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    return ' AND '.join(clauses) or '1', params
+
+
+def search(conn, text, limit=100):
+    """Transactions whose description contains every word of text (any case)."""
+    where, params = search_query(text, fts_available(conn))
+    return _fetch(conn, where, params, limit)
+
+
+def try_rule(conn, desc_pattern, type_pattern='.*'):
+    """Transactions a new rule would match, using the index to find candidates.
+
+    Candidates must contain the pattern's required literal (or, for the
+    whitespace-insensitive retry, the stripped literal in the squashed
+    column); the rule is then run on just those with regex_search() semantics.
+    """
+    desc_compiled = compile_pattern(desc_pattern)
+    type_compiled = compile_pattern(type_pattern)
+    primary, fallback, literal, fallback_literal = desc_compiled
+    if primary is None:
+        return []
+
+    literals = [('description', literal)]
+    if fallback is not None:
+        literals.append(('squashed', fallback_literal))
+    if fts_available(conn) and all(len(lit) >= MIN_TERM for _, lit in literals):
+        query = ' OR '.join(f'{col} : {_phrase(lit)}' for col, lit in literals)
+        rows = _fetch(conn, f't.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)', [query], None)
+    else:
+        # nothing selective enough to look up, so check every row
+        rows = _fetch(conn, '1', [], None)
+    return [r for r in rows
+            if search_prepared(type_compiled, prepare_text(r[2])) and search_prepared(desc_compiled, prepare_text(r[3]))]
+
+
+def rule_hits(conn, rule_id, limit=None):
+    """Transactions categorised by a rule (its id in categories), via the rule_id index."""
+    return _fetch(conn, 'c.rule_id = ?', [rule_id], limit)
+
+
+def print_rows(rows):
+    for txn_id, date, txn_type, desc, paid_in, paid_out, main_category, sub1 in rows:
+        amount = (paid_in or 0.0) - (paid_out or 0.0)
+        category = ' / '.join(c for c in (main_category, sub1) if c) or 'Uncategorised'
+        print(f"{date}  {amount:>10.2f}  {txn_type:<12} {desc}  [{category}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search transactions by payee, or try out a rule pattern.")
+    parser.add_argument('text', nargs='?', help="Words that must all appear in the description")
+    parser.add_argument('--regex', help="Try a description_pattern as categorise_md.py would apply it")
+    parser.add_argument('--type', default='.*', help="transaction_type_pattern to go with --regex")
+    parser.add_argument('--rule', type=int, help="Show what the rule with this id in categories currently catches")
+    parser.add_argument('--limit', type=int, default=100, help="Maximum rows to show (0 = all)")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the search index first")
+    args = parser.parse_args()
+
+    if not args.text and not args.regex and args.rule is None and not args.rebuild:
+        parser.print_usage()
+        sys.exit(1)
+
+    conn = sqlite3.connect(args.db)
+    schema.require_current(conn, args.db)
+    if args.rebuild:
+        print(f'Indexed {rebuild_index(args.db)} transactions.')
+    elif not fts_available(conn):
+        print(f"⚠️ {args.db} has no search index, so every row is read; `py search.py --rebuild` adds it.")
+
+    if args.regex:
+        rows = try_rule(conn, args.regex, args.type)
+        spent = sum((r[5] or 0.0) - (r[4] or 0.0) for r in rows)
+        by_category = {}
+        for r in rows:
+            key = r[6] or 'Uncategorised'
+            by_category[key] = by_category.get(key, 0) + 1
+        print(f"Rule '{args.type} | {args.regex}' matches {len(rows)} transactions (net spend £{spent:,.2f})")
+        for category, count in sorted(by_category.items(), key=lambda kv: -kv[1]):
+            print(f"  currently {category}: {count}")
+        print_rows(rows[:args.limit] if args.limit else rows)
+    elif args.rule is not None:
+        rule = conn.execute(
+            'SELECT transaction_type_pattern, description_pattern FROM categories WHERE id = ?', (args.rule,)
+        ).fetchone()
+        if rule is None:
+            print(f"No rule with id {args.rule} in categories.")
+        else:
+            total, spent = conn.execute('''
+                SELECT count(*), COALESCE(sum(COALESCE(t.paid_out, 0) - COALESCE(t.paid_in, 0)), 0)
+                FROM categorised c JOIN transactions t ON t.id = c.transaction_id
+                WHERE c.rule_id = ?
+            ''', (args.rule,)).fetchone()
+            print(f"Rule {args.rule} '{rule[0]} | {rule[1]}' categorises {total} transactions (net spend £{spent:,.2f})")
+            print_rows(rule_hits(conn, args.rule, args.limit))
+    elif args.text:
+        rows = search(conn, args.text, args.limit)
+        print_rows(rows)
+        print(f"{len(rows)} transaction(s) found.")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
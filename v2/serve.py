@@ -0,0 +1,124 @@
+import sqlite3
+import json
+import os
+import argparse
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import schema
+import search
+
+DB_FILE = 'load_statement.db'
+PORT = 8000
+# precompressed copies written by display.py, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+class DashboardHandler(SimpleHTTPRequestHandler):
+    """Serves the generated reports, plus /search backed by the full-text index.
+
+    A file with an up-to-date .br or .gz copy next to it is sent compressed
+    to browsers that accept that encoding.
+    """
+
+    db_file = DB_FILE
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/search':
+            self.send_search(parse_qs(url.query))
+        elif not self.send_precompressed(url.path):
+            super().do_GET()
+
+    def accepted_encodings(self):
+        accepted = set()
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = item.partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(name.strip().lower())
+        return accepted
+
+    def send_precompressed(self, url_path):
+        path = self.translate_path(url_path)
+        if os.path.isdir(path):
+            # without the trailing slash the base class redirects, so that
+            # the index page's relative links resolve inside the directory
+            if not url_path.endswith('/'):
+                return False
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            return False
+        accepted = self.accepted_encodings()
+        for encoding, suffix in ENCODINGS:
+            compressed = path + suffix
+            # a copy older than its file is stale
+            if encoding not in accepted or not os.path.isfile(compressed) \
+                    or os.path.getmtime(compressed) < os.path.getmtime(path):
+                continue
+            with open(compressed, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+        return False
+
+    def send_search(self, query):
+        text = query.get('q', [''])[0]
+        regex = query.get('regex', [''])[0]
+        try:
+            limit = int(query.get('limit', ['200'])[0] or 0)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            self.send_error(400, 'limit must be a whole number, 0 for no limit')
+            return
+        conn = sqlite3.connect(self.db_file)
+        try:
+            if regex:
+                rows = search.try_rule(conn, regex, query.get('type', ['.*'])[0] or '.*')
+                rows = rows[:limit] if limit else rows
+            elif text.strip():
+                rows = search.search(conn, text, limit)
+            else:
+                rows = []
+        finally:
+            conn.close()
+        body = json.dumps([dict(zip(search.RESULT_COLUMNS, r)) for r in rows]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard with live transaction search.")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--directory', default='.', help="Folder holding display.html")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.require_current(conn, args.db)
+    if not search.fts_available(conn):
+        print(f"⚠️ {args.db} has no search index, so searches read every row; `py search.py --rebuild` adds it.")
+    conn.close()
+    DashboardHandler.db_file = args.db
+    handler = functools.partial(DashboardHandler, directory=args.directory)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    print(f'Serving dashboard on http://127.0.0.1:{args.port}/display.html (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import sqlite3
+import os
+import argparse
+
+import schema
+import search
+from list_uncategorised import DB_FILE, cluster_uncategorised, fetch_uncategorised, normalise_payee
+
+# shortest description prefix worth turning into a rule
+MIN_PREFIX = 4
+# characters that mean something in a pattern; '|' would also split the markdown row
+_SPECIAL = set('.^$*+?{}[]\\()')
+_COLUMNS = [('transaction_type_pattern', 24), ('description_pattern', 32), ('main_category', 13),
+            ('sub1', 15), ('sub2', 21), ('sub3', 16), ('notes', 41)]
+
+
+def escape_prefix(prefix):
+    """Literal prefix as a readable pattern: only regex metacharacters are escaped."""
+    return ''.join('.' if c == '|' else '\\' + c if c in _SPECIAL else c for c in prefix)
+
+
+def candidate_prefixes(descriptions):
+    """Common prefixes of the descriptions, cut at word boundaries, shortest first."""
+    prefix = os.path.commonprefix([d.upper() for d in descriptions])
+    cuts = [i for i in range(1, len(prefix)) if not prefix[i].isalnum()] + [len(prefix)]
+    prefixes = []
+    for i in cuts:
+        candidate = prefix[:i].rstrip()
+        if len(candidate) >= MIN_PREFIX and candidate not in prefixes:
+            prefixes.append(candidate)
+    return prefixes
+
+
+def groups_for(cluster):
+    """Description sets that each need one rule: the whole cluster if its
+    descriptions share a prefix, otherwise one per normalised payee."""
+    descriptions = sorted({desc for _, desc in cluster['variants']})
+    if candidate_prefixes(descriptions):
+        return [(cluster['label'], descriptions)]
+    by_payee = {}
+    for desc in descriptions:
+        by_payee.setdefault(normalise_payee(desc), []).append(desc)
+    return sorted(by_payee.items())
+
+
+def check_pattern(conn, pattern, own_ids, uncategorised_ids):
+    """What a rule would capture across the whole history, via search.try_rule()
+    (an index lookup, then the compiled matcher categorise_md.py applies)."""
+    covered, categorised, other = set(), {}, 0
+    for row in search.try_rule(conn, pattern):
+        txn_id, category = row[0], row[6]
+        if txn_id in own_ids:
+            covered.add(txn_id)
+        elif txn_id in uncategorised_ids:
+            other += 1
+        else:
+            categorised[category] = categorised.get(category, 0) + 1
+    return covered, categorised, other
+
+
+def suggest_rules(conn, top=None, min_count=1):
+    """Propose an anchored description_pattern per uncategorised payee cluster.
+
+    Each candidate prefix is tried shortest first against every transaction;
+    the first that captures nothing already categorised and no other
+    cluster's transactions wins. If every prefix collides, the longest one
+    is suggested with its collisions reported. Returns a list of dicts.
+    """
+    clusters = cluster_uncategorised(conn)
+    uncategorised_ids = {row[0] for c in clusters for row in c['rows']}
+    clusters = [c for c in clusters if c['count'] >= min_count]
+    suggestions, seen = [], set()
+
+    for cluster in clusters[:top] if top else clusters:
+        for label, descriptions in groups_for(cluster):
+            wanted = set(descriptions)
+            own = [row for row in cluster['rows'] if (row[3] or '') in wanted]
+            own_ids = {row[0] for row in own}
+            prefixes = candidate_prefixes(descriptions)
+            if not prefixes:
+                suggestions.append({'label': label, 'pattern': None, 'count': len(own),
+                                    'covered': 0, 'spent': 0.0, 'categorised': {}, 'other': 0})
+                continue
+            for prefix in prefixes:
+                pattern = '^' + escape_prefix(prefix)
+                covered, categorised, other = check_pattern(conn, pattern, own_ids, uncategorised_ids)
+                if not categorised and not other:
+                    break
+            if pattern in seen:
+                continue
+            seen.add(pattern)
+            suggestions.append({
+                'label': label,
+                'pattern': pattern,
+                'count': len(own),
+                'covered': len(covered),
+                'spent': sum((r[5] or 0.0) - (r[4] or 0.0) for r in own if r[0] in covered),
+                'categorised': categorised,
+                'other': other,
+            })
+    return suggestions
+
+
+def format_row(values):
+    return '| ' + ' | '.join(f'{v:<{width}}' for v, (_, width) in zip(values, _COLUMNS)) + ' |'
+
+
+def print_suggestions(suggestions, total):
+    """Print the paste-ready rows, then each suggestion's coverage.
+
+    Coverage is covered/count of the cluster's own uncategorised transactions
+    and their net spend, plus any categorised or other-cluster transactions
+    the pattern would also capture.
+    """
+    usable = [s for s in suggestions if s['pattern']]
+    if not usable:
+        print("No rules to suggest.")
+        return
+
+    # main_category is left blank: categorise_md.py refuses the file until it is filled in
+    print("Suggested rules (paste into categories.md, then fill in main_category):\n")
+    print(format_row([name for name, _ in _COLUMNS]))
+    print('| ' + ' | '.join('-' * width for _, width in _COLUMNS) + ' |')
+    for s in usable:
+        print(format_row(['.*', s['pattern'], '', s['label'].title()[:15], '', '', '']))
+
+    print("\nCoverage:")
+    for n, s in enumerate(suggestions, 1):
+        if not s['pattern']:
+            print(f"{n:>3}. ⚠️ {s['label']}: no common prefix across {s['count']} txns; write this rule by hand")
+            continue
+        line = f"{s['pattern']}: {s['covered']}/{s['count']} txns, £{s['spent']:,.2f} net spend"
+        clashes = [f"{count} already {category}" for category, count in sorted(s['categorised'].items())]
+        if s['other']:
+            clashes.append(f"{s['other']} from other clusters")
+        if clashes:
+            line = f"⚠️ {line}; also captures " + ', '.join(clashes)
+        print(f"{n:>3}. {line}")
+
+    covered = sum(s['covered'] for s in usable)
+    share = covered / total * 100 if total else 0.0
+    print(f"\n✅ {len(usable)} rules cover {covered} of {total} uncategorised transactions ({share:.1f}%).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest categories.md rules for uncategorised transactions.")
+    parser.add_argument('--top', type=int, default=None, help="Only the N clusters with the most money at stake")
+    parser.add_argument('--min-count', type=int, default=2, help="Skip clusters with fewer transactions than this")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.require_current(conn, args.db)
+    total = len(fetch_uncategorised(conn))
+    suggestions = suggest_rules(conn, args.top, args.min_count)
+    conn.close()
+    print_suggestions(suggestions, total)
+
+
+if __name__ == '__main__':
+    main()
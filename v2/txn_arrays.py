@@ -0,0 +1,161 @@
+import sqlite3
+import argparse
+
+import numpy as np
+
+import queries
+import schema
+
+DB_FILE = 'load_statement.db'
+FETCH_SIZE = 50000
+LEVELS = ['main_category', 'sub1', 'sub2', 'sub3']
+
+# one record per transaction: dates as integers, money in pence, and every
+# string column as a code into the matching vocabulary list
+ROW_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('day', np.int32),          # days since 1970-01-01
+    ('month', np.int32),        # months since 1970-01
+    ('paid_in', np.int64),
+    ('paid_out', np.int64),
+    ('amount', np.int64),       # paid_in - paid_out
+    ('rule_id', np.int32),      # -1 when Uncategorised
+    ('account', np.int32),
+    ('main_category', np.int32),
+    ('sub1', np.int32),
+    ('sub2', np.int32),
+    ('sub3', np.int32),
+])
+_CODED = ['account'] + LEVELS
+
+
+def _encode(values, vocab, index):
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(vocab)
+            vocab.append(value)
+        codes[i] = code
+    return codes
+
+
+def _pence(values):
+    return np.rint(np.array(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def load_arrays(db_file=DB_FILE, fetch_size=FETCH_SIZE):
+    """Load transactions with their categories into columnar NumPy arrays.
+
+    Returns a dict with 'rows' (a ROW_DTYPE structured array in date order),
+    'description' (an object array alongside it) and, for each coded column
+    (account, main_category, sub1, sub2, sub3), the list of strings its codes
+    index. Rows are fetched in batches of fetch_size straight into
+    preallocated arrays.
+    """
+    with sqlite3.connect(db_file) as conn:
+        total = conn.execute(queries.DATED_TRANSACTION_COUNT).fetchone()[0]
+        rows = np.empty(total, dtype=ROW_DTYPE)
+        description = np.empty(total, dtype=object)
+        vocab = {col: [] for col in _CODED}
+        index = {col: {} for col in _CODED}
+        cursor = conn.execute(queries.TRANSACTIONS_WITH_CATEGORIES)
+        start = 0
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                break
+            end = start + len(batch)
+            ids, dates, paid_in, paid_out, rule_ids, *coded, descs = zip(*batch)
+            chunk = rows[start:end]
+            chunk['id'] = ids
+            days = np.array([d[:10] for d in dates], dtype='datetime64[D]')
+            chunk['day'] = days.astype(np.int64)
+            chunk['month'] = days.astype('datetime64[M]').astype(np.int64)
+            chunk['paid_in'] = _pence(paid_in)
+            chunk['paid_out'] = _pence(paid_out)
+            chunk['amount'] = chunk['paid_in'] - chunk['paid_out']
+            chunk['rule_id'] = rule_ids
+            for col, values in zip(_CODED, coded):
+                chunk[col] = _encode(values, vocab[col], index[col])
+            description[start:end] = descs
+            start = end
+
+    data = {'rows': rows[:start], 'description': description[:start]}
+    data.update(vocab)
+    return data
+
+
+def month_label(month):
+    """'YYYY-MM' for a month code (months since 1970-01)."""
+    return str(np.datetime64(int(month), 'M'))
+
+
+def day_label(day):
+    return str(np.datetime64(int(day), 'D'))
+
+
+def group_codes(data, levels):
+    """One code per distinct combination of the given coded columns.
+
+    Returns (codes per row, [label tuples]) with labels in sorted order.
+    """
+    rows = data['rows']
+    if not levels:
+        return np.zeros(len(rows), dtype=np.int64), [()]
+    stacked = np.stack([rows[level] for level in levels], axis=1)
+    keys, codes = np.unique(stacked, axis=0, return_inverse=True)
+    labels = [tuple(data[level][code] for level, code in zip(levels, key)) for key in keys]
+    order = sorted(range(len(labels)), key=labels.__getitem__)
+    remap = np.empty(len(order), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return remap[codes.ravel()], [labels[i] for i in order]
+
+
+def month_category_sums(data, levels=('main_category', 'sub1'), value='amount'):
+    """Month x category totals in pounds, computed with one bincount.
+
+    Returns (months as 'YYYY-MM', category label tuples, matrix) where
+    matrix[i, j] is the sum of value for months[i] and categories[j].
+    """
+    rows = data['rows']
+    month_keys, month_codes = np.unique(rows['month'], return_inverse=True)
+    cat_codes, categories = group_codes(data, levels)
+    cells = month_codes.ravel() * len(categories) + cat_codes
+    sums = np.bincount(cells, weights=rows[value], minlength=len(month_keys) * len(categories))
+    matrix = sums.reshape(len(month_keys), len(categories)) / 100
+    return [month_label(m) for m in month_keys], categories, matrix
+
+
+def monthly_totals(data):
+    """Money in, money out and net per month in pounds, using reduceat over the date-ordered rows."""
+    rows = data['rows']
+    if not len(rows):
+        return [], np.zeros((0, 3))
+    starts = np.flatnonzero(np.r_[True, np.diff(rows['month']) != 0])
+    columns = np.stack([rows['paid_in'], rows['paid_out'], rows['amount']], axis=1)
+    totals = np.add.reduceat(columns, starts, axis=0) / 100
+    return [month_label(m) for m in rows['month'][starts]], totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load transactions into NumPy arrays and print month x category totals.")
+    parser.add_argument('--by', nargs='+', default=['main_category'], choices=LEVELS + ['account'],
+                        help="Columns to total by")
+    parser.add_argument('--db', default=DB_FILE, help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.db) as conn:
+        schema.require_current(conn, args.db)
+    data = load_arrays(args.db)
+    months, categories, matrix = month_category_sums(data, args.by)
+    labels = [' / '.join(c for c in cat if c) or '(none)' for cat in categories]
+    width = max([len(label) for label in labels] + [8])
+    print(' ' * width + ''.join(f'{m:>11}' for m in months))
+    for j, label in enumerate(labels):
+        print(f'{label:<{width}}' + ''.join(f'{v:>11,.2f}' for v in matrix[:, j]))
+    print(f"{len(data['rows'])} transactions, {len(months)} months")
+
+
+if __name__ == '__main__':
+    main()